@@ -9,8 +9,20 @@ import requests
 import streamlit as st
 from PIL import Image
 
-from templates import VIDEO_TEMPLATES
+from templates import IMAGE_DERIVATIVES, VIDEO_TEMPLATES
 from prompt_engine import build_video_prompt
+from deadline import Deadline
+from doc_extract import DOC_PREVIEW_CHARS, extract_text, full_text_if_ready, submit_full_text
+from endpoint_router import EndpointRouter, parse_bases
+from hedging import HedgePolicy
+from image_response import collect_texts, iter_inline_images
+from key_pool import KeyPool, parse_keys
+from request_journal import build_journal
+from shared_state import get_state
+from model_selector import VeoModelSelector
+from derivatives import derivative_filename, render_derivatives
+from video_cache import cache_source
+from video_reframe import RATIO_MAX_SIZE, submit_reframe
 
 
 st.set_page_config(
@@ -161,36 +173,14 @@ def _extract_text_from_file(uploaded_file) -> Tuple[str, str]:
     if uploaded_file is None:
         return "", ""
     try:
-        data = uploaded_file.read()
-        uploaded_file.seek(0)
+        data = uploaded_file.getvalue()
     except Exception:
         return "", "无法读取文档内容。"
 
-    name = (uploaded_file.name or "").lower()
-    if name.endswith(".pdf"):
-        try:
-            from pypdf import PdfReader  # type: ignore
-
-            reader = PdfReader(io.BytesIO(data))
-            text = "\n".join((page.extract_text() or "") for page in reader.pages)
-            return text.strip(), ""
-        except Exception as exc:
-            return "", f"PDF 解析失败：{exc}"
-
-    if name.endswith(".docx"):
-        try:
-            from docx import Document  # type: ignore
-
-            doc = Document(io.BytesIO(data))
-            text = "\n".join(p.text for p in doc.paragraphs)
-            return text.strip(), ""
-        except Exception as exc:
-            return "", f"DOCX 解析失败：{exc}"
-
-    try:
-        return data.decode("utf-8", errors="ignore").strip(), ""
-    except Exception:
-        return "", "文档解析失败，请转换为 TXT / PDF / DOCX。"
+    # 提示词与预览只用前 800 字，按字数预算提前结束解析；全文在后台进程中解析备用
+    name = uploaded_file.name or ""
+    submit_full_text(data, name)
+    return extract_text(data, name, budget=DOC_PREVIEW_CHARS)
 
 
 def _guess_mime_type(filename: str, fallback: str = "image/png") -> str:
@@ -221,20 +211,48 @@ APIYI_BASE = "https://api.apiyi.com"
 IMAGE_MODEL = "gemini-3-pro-image-preview"
 
 
-def _require_api_key() -> str:
-    key = st.secrets.get("APIYI_API_KEY")
-    if not key:
-        raise ValueError("缺少 APIYI_API_KEY，请在 Streamlit Secrets 中配置。")
-    return key
+@st.cache_resource
+def _endpoint_router(bases: Tuple[str, ...]) -> EndpointRouter:
+    return EndpointRouter(bases, journal=build_journal())
 
 
-def _apiyi_generate_image(
-    prompt: str,
-    aspect_ratio: Optional[str] = None,
-    image_size: Optional[str] = None,
-) -> Tuple[List[Image.Image], str, dict]:
-    endpoint = f"{APIYI_BASE}/v1beta/models/{IMAGE_MODEL}:generateContent"
-    generation_config = {"responseModalities": ["IMAGE"]}
+@st.cache_resource
+def _hedge_policy() -> HedgePolicy:
+    return HedgePolicy()
+
+
+def _router() -> EndpointRouter:
+    # APIYI_BASES 可配置多个网关地址，按实时延迟与错误率选择，未配置时使用默认地址
+    bases = (
+        parse_bases(st.secrets.get("APIYI_BASES"))
+        or parse_bases(st.secrets.get("APIYI_BASE"))
+        or [APIYI_BASE]
+    )
+    return _endpoint_router(tuple(bases))
+
+
+@st.cache_resource
+def _key_pool(keys: Tuple[str, ...]) -> KeyPool:
+    return KeyPool(keys, state=get_state())
+
+
+def _require_api_key() -> KeyPool:
+    # APIYI_API_KEYS 可配置为列表或逗号分隔字符串，未配置时回退到单个 APIYI_API_KEY
+    keys = parse_keys(st.secrets.get("APIYI_API_KEYS")) or parse_keys(st.secrets.get("APIYI_API_KEY"))
+    if not keys:
+        raise ValueError("缺少 APIYI_API_KEY，请在 Streamlit Secrets 中配置。")
+    return _key_pool(tuple(keys))
+
+
+def _build_generation_config(
+    aspect_ratio: Optional[str],
+    image_size: Optional[str],
+    candidate_count: int = 1,
+    with_text: bool = False,
+) -> dict:
+    generation_config = {"responseModalities": ["TEXT", "IMAGE"] if with_text else ["IMAGE"]}
+    if candidate_count and candidate_count > 1:
+        generation_config["candidateCount"] = candidate_count
     image_config = {}
     if aspect_ratio:
         image_config["aspectRatio"] = aspect_ratio
@@ -242,46 +260,78 @@ def _apiyi_generate_image(
         image_config["imageSize"] = image_size
     if image_config:
         generation_config["imageConfig"] = image_config
+    return generation_config
+
+
+def _apiyi_generate_image(
+    prompt: str,
+    aspect_ratio: Optional[str] = None,
+    image_size: Optional[str] = None,
+    candidate_count: int = 1,
+    with_text: bool = False,
+    deadline: Optional[Deadline] = None,
+    hedge: bool = False,
+) -> Tuple[List[Image.Image], str, dict]:
+    endpoint = f"/v1beta/models/{IMAGE_MODEL}:generateContent"
+    generation_config = _build_generation_config(aspect_ratio, image_size, candidate_count, with_text)
 
     payload = {
         "contents": [{"parts": [{"text": prompt}]}],
         "generationConfig": generation_config,
     }
 
+    deadline = deadline or Deadline()
     data = {}
     max_retries = 4
     base_delay = 1.5
     timeout_map = {"1K": 180, "2K": 300, "4K": 360}
     timeout = timeout_map.get(image_size or "1K", 180)
+    key_pool = _require_api_key()
+
+    def _send(attempt_deadline: Deadline, skip: int = 0):
+        with key_pool.lease(attempt_deadline) as lease:
+            response = _router().request(
+                "POST",
+                endpoint,
+                route=f"image_generate:{image_size or '1K'}",
+                deadline=attempt_deadline,
+                timeout=timeout,
+                skip=skip,
+                headers={"Authorization": f"Bearer {lease.key}", "Content-Type": "application/json"},
+                json=payload,
+            )
+            lease.report(response)
+        return response
+
     for attempt in range(max_retries):
-        response = requests.post(
-            endpoint,
-            headers={"Authorization": f"Bearer {_require_api_key()}", "Content-Type": "application/json"},
-            json=payload,
-            timeout=timeout,
-        )
+        if hedge:
+            response = _hedge_policy().run(
+                f"{IMAGE_MODEL}:{image_size or '1K'}",
+                _send,
+                deadline,
+                is_success=lambda resp: resp.status_code < 400,
+            )
+        else:
+            response = _send(deadline)
         if response.status_code in {429, 500, 503, 504} and attempt < max_retries - 1:
+            if response.status_code == 429 and key_pool.has_ready_key():
+                continue
             retry_after = response.headers.get("Retry-After")
             if retry_after and retry_after.isdigit():
                 sleep_for = float(retry_after)
             else:
                 sleep_for = base_delay * (2 ** attempt) + random.uniform(0, 0.7)
-            time.sleep(min(sleep_for, 12))
+            deadline.sleep(min(sleep_for, 12))
             continue
         if response.status_code >= 400:
             raise ValueError(response.text)
         data = response.json()
         break
 
-    images_out: List[Image.Image] = []
-    texts: List[str] = []
-    try:
-        part = data["candidates"][0]["content"]["parts"][0]
-        inline_data = (part.get("inlineData") or part.get("inline_data") or {}).get("data")
-    except (KeyError, IndexError, TypeError, AttributeError):
-        inline_data = None
-    if inline_data:
-        images_out.append(Image.open(io.BytesIO(base64.b64decode(inline_data))))
+    images_out: List[Image.Image] = [
+        Image.open(io.BytesIO(image_bytes)) for _, _, image_bytes in iter_inline_images(data)
+    ]
+    texts = collect_texts(data)
     return images_out, "\n".join(texts).strip(), data
 
 
@@ -290,8 +340,11 @@ def _apiyi_edit_image(
     prompt: str,
     aspect_ratio: Optional[str] = None,
     image_size: Optional[str] = None,
+    candidate_count: int = 1,
+    with_text: bool = False,
+    deadline: Optional[Deadline] = None,
 ) -> Tuple[List[Image.Image], str, dict]:
-    endpoint = f"{APIYI_BASE}/v1beta/models/{IMAGE_MODEL}:generateContent"
+    endpoint = f"/v1beta/models/{IMAGE_MODEL}:generateContent"
     if not image_files:
         raise ValueError("请至少选择一张图片进行编辑。")
     parts = [{"text": prompt}]
@@ -300,14 +353,7 @@ def _apiyi_edit_image(
         if not image_b64:
             raise ValueError("上传图片为空或无法读取，请重新上传后再试。")
         parts.append({"inline_data": {"mime_type": mime_type, "data": image_b64}})
-    generation_config = {"responseModalities": ["IMAGE"]}
-    image_config = {}
-    if aspect_ratio:
-        image_config["aspectRatio"] = aspect_ratio
-    if image_size:
-        image_config["imageSize"] = image_size
-    if image_config:
-        generation_config["imageConfig"] = image_config
+    generation_config = _build_generation_config(aspect_ratio, image_size, candidate_count, with_text)
 
     payload = {
         "contents": [{
@@ -316,43 +362,80 @@ def _apiyi_edit_image(
         "generationConfig": generation_config,
     }
 
+    deadline = deadline or Deadline()
     data = {}
     max_retries = 4
     base_delay = 1.5
     timeout_map = {"1K": 180, "2K": 300, "4K": 360}
     timeout = timeout_map.get(image_size or "1K", 180)
+    key_pool = _require_api_key()
     for attempt in range(max_retries):
-        response = requests.post(
-            endpoint,
-            headers={"Authorization": f"Bearer {_require_api_key()}", "Content-Type": "application/json"},
-            json=payload,
-            timeout=timeout,
-        )
+        with key_pool.lease(deadline) as lease:
+            response = _router().request(
+                "POST",
+                endpoint,
+                route=f"image_edit:{image_size or '1K'}",
+                deadline=deadline,
+                timeout=timeout,
+                headers={"Authorization": f"Bearer {lease.key}", "Content-Type": "application/json"},
+                json=payload,
+            )
+            lease.report(response)
         if response.status_code in {429, 500, 503, 504} and attempt < max_retries - 1:
+            if response.status_code == 429 and key_pool.has_ready_key():
+                continue
             retry_after = response.headers.get("Retry-After")
             if retry_after and retry_after.isdigit():
                 sleep_for = float(retry_after)
             else:
                 sleep_for = base_delay * (2 ** attempt) + random.uniform(0, 0.7)
-            time.sleep(min(sleep_for, 12))
+            deadline.sleep(min(sleep_for, 12))
             continue
         if response.status_code >= 400:
             raise ValueError(response.text)
         data = response.json()
         break
 
-    images_out: List[Image.Image] = []
-    texts: List[str] = []
-    try:
-        part = data["candidates"][0]["content"]["parts"][0]
-        inline_data = (part.get("inlineData") or part.get("inline_data") or {}).get("data")
-    except (KeyError, IndexError, TypeError, AttributeError):
-        inline_data = None
-    if inline_data:
-        images_out.append(Image.open(io.BytesIO(base64.b64decode(inline_data))))
+    images_out: List[Image.Image] = [
+        Image.open(io.BytesIO(image_bytes)) for _, _, image_bytes in iter_inline_images(data)
+    ]
+    texts = collect_texts(data)
     return images_out, "\n".join(texts).strip(), data
 
 
+def _render_platform_derivatives(raw: dict, names: List[str]) -> List[Dict]:
+    outputs = []
+    if not names:
+        return outputs
+    for idx, (_, _, image_bytes) in enumerate(iter_inline_images(raw), start=1):
+        rendered = render_derivatives(image_bytes, names)
+        for name, (data, mime_type) in rendered.items():
+            outputs.append({
+                "name": name,
+                "index": idx,
+                "data": data,
+                "mime": mime_type,
+                "file_name": derivative_filename(name, stem=f"result{idx}"),
+            })
+    return outputs
+
+
+def _show_derivative_downloads(state_key: str) -> None:
+    items = st.session_state.get(state_key) or []
+    if not items:
+        return
+    st.markdown("**平台尺寸下载**")
+    cols = st.columns(3)
+    for pos, item in enumerate(items):
+        cols[pos % 3].download_button(
+            f"结果 {item['index']} · {item['name']}",
+            data=item["data"],
+            file_name=item["file_name"],
+            mime=item["mime"],
+            key=f"{state_key}_{pos}",
+        )
+
+
 def _pick_veo_model(video_ratio: str, use_frames: bool, use_fast: bool = False) -> str:
     model = "veo-3.1"
     if video_ratio == "16:9":
@@ -364,79 +447,130 @@ def _pick_veo_model(video_ratio: str, use_frames: bool, use_fast: bool = False)
     return model
 
 
-def _apiyi_create_veo_task(prompt: str, model: str, image_files: Optional[List] = None) -> str:
-    headers = {"Authorization": _require_api_key()}
-    if image_files:
-        files = []
-        for image_file in image_files[:2]:
-            image_b64, mime_type = _file_to_base64(image_file)
-            if not image_b64:
-                raise ValueError("参考图为空或无法读取，请重新上传后再试。")
-            image_bytes = base64.b64decode(image_b64)
-            filename = getattr(image_file, "name", "frame.png")
-            files.append(("input_reference", (filename, image_bytes, mime_type)))
-        resp = requests.post(
-            f"{APIYI_BASE}/v1/videos",
-            headers=headers,
-            data={"prompt": prompt, "model": model},
-            files=files,
-            timeout=300,
-        )
-    else:
-        resp = requests.post(
-            f"{APIYI_BASE}/v1/videos",
-            headers={**headers, "Content-Type": "application/json"},
-            json={"prompt": prompt, "model": model},
-            timeout=300,
-        )
+@st.cache_resource
+def _veo_selector() -> VeoModelSelector:
+    return VeoModelSelector(_pick_veo_model)
+
+
+def _apiyi_create_veo_task(
+    prompt: str,
+    model: str,
+    deadline: Deadline,
+    image_files: Optional[List] = None,
+) -> str:
+    files = []
+    for image_file in (image_files or [])[:2]:
+        image_b64, mime_type = _file_to_base64(image_file)
+        if not image_b64:
+            raise ValueError("参考图为空或无法读取，请重新上传后再试。")
+        image_bytes = base64.b64decode(image_b64)
+        filename = getattr(image_file, "name", "frame.png")
+        files.append(("input_reference", (filename, image_bytes, mime_type)))
+    with _require_api_key().lease(deadline) as lease:
+        headers = {"Authorization": lease.key}
+        if files:
+            resp = _router().request(
+                "POST",
+                "/v1/videos",
+                route="veo_create",
+                deadline=deadline,
+                timeout=300,
+                headers=headers,
+                data={"prompt": prompt, "model": model},
+                files=files,
+            )
+        else:
+            resp = _router().request(
+                "POST",
+                "/v1/videos",
+                route="veo_create",
+                deadline=deadline,
+                timeout=300,
+                headers={**headers, "Content-Type": "application/json"},
+                json={"prompt": prompt, "model": model},
+            )
+        lease.report(resp)
     if resp.status_code >= 400:
         raise ValueError(resp.text)
     payload = resp.json()
     video_id = payload.get("id")
     if not video_id:
         raise ValueError("创建任务失败，未返回 video_id。")
+    # VEO 任务只能用创建它的 key 查询
+    st.session_state.setdefault("veo_task_keys", {})[video_id] = lease.key
     return video_id
 
 
-def _apiyi_get_veo_status(video_id: str) -> dict:
-    resp = requests.get(
-        f"{APIYI_BASE}/v1/videos/{video_id}",
-        headers={"Authorization": _require_api_key()},
-        timeout=120,
-    )
+def _apiyi_get_veo_status(video_id: str, deadline: Deadline) -> dict:
+    task_key = st.session_state.get("veo_task_keys", {}).get(video_id)
+    with _require_api_key().lease(deadline, prefer=task_key) as lease:
+        resp = _router().request(
+            "GET",
+            f"/v1/videos/{video_id}",
+            route="veo_status",
+            deadline=deadline,
+            timeout=120,
+            headers={"Authorization": lease.key},
+        )
+        lease.report(resp)
     if resp.status_code >= 400:
         raise ValueError(resp.text)
     return resp.json()
 
 
-def _apiyi_get_veo_content(video_id: str) -> dict:
-    resp = requests.get(
-        f"{APIYI_BASE}/v1/videos/{video_id}/content",
-        headers={"Authorization": _require_api_key()},
-        timeout=120,
-    )
+def _apiyi_get_veo_content(video_id: str, deadline: Deadline) -> dict:
+    task_key = st.session_state.get("veo_task_keys", {}).get(video_id)
+    with _require_api_key().lease(deadline, prefer=task_key) as lease:
+        resp = _router().request(
+            "GET",
+            f"/v1/videos/{video_id}/content",
+            route="veo_content",
+            deadline=deadline,
+            timeout=120,
+            headers={"Authorization": lease.key},
+        )
+        lease.report(resp)
     if resp.status_code >= 400:
         raise ValueError(resp.text)
     return resp.json()
 
 
-def _apiyi_wait_for_veo(video_id: str, timeout: int = 900, interval: int = 6) -> dict:
+def _apiyi_wait_for_veo(video_id: str, deadline: Deadline, timeout: int = 900, interval: int = 6) -> dict:
     start = time.time()
     while time.time() - start < timeout:
-        status_data = _apiyi_get_veo_status(video_id)
+        status_data = _apiyi_get_veo_status(video_id, deadline)
         status = status_data.get("status")
         if status == "completed":
-            return _apiyi_get_veo_content(video_id)
+            return _apiyi_get_veo_content(video_id, deadline)
         if status == "failed":
             raise ValueError(f"视频生成失败：{status_data}")
-        time.sleep(interval)
+        deadline.sleep(interval)
     raise TimeoutError("等待视频生成超时。")
 
 
-def _apiyi_download_video(url: str) -> bytes:
-    resp = requests.get(url, timeout=600)
-    resp.raise_for_status()
-    return resp.content
+def _apiyi_download_video(url: str, deadline: Deadline) -> bytes:
+    buffer = io.BytesIO()
+    start = time.monotonic()
+    status = None
+    try:
+        with requests.get(url, timeout=deadline.timeout(600), stream=True) as resp:
+            status = resp.status_code
+            resp.raise_for_status()
+            for chunk in resp.iter_content(chunk_size=1 << 16):
+                deadline.check()
+                buffer.write(chunk)
+    finally:
+        journal = _router().journal
+        if journal is not None:
+            journal.record(
+                "GET",
+                url,
+                "veo_download",
+                status=status,
+                latency=time.monotonic() - start,
+                response_bytes=buffer.tell(),
+            )
+    return buffer.getvalue()
 
 
 _inject_style()
@@ -544,6 +678,9 @@ with right:
 
     if product_doc:
         st.caption(f"需求文档：{product_doc.name} ({product_doc.size} bytes)")
+        full_text = full_text_if_ready(product_doc.getvalue(), product_doc.name or "")
+        if full_text is not None:
+            st.caption(f"全文已解析：{len(full_text)} 字")
         if doc_parse_warning:
             st.warning(doc_parse_warning)
         if text_from_doc:
@@ -573,7 +710,14 @@ with video_tab:
         height=120,
     )
     video_ratio = st.selectbox("画幅", ["16:9", "9:16"])
-    use_fast = st.toggle("快速模式（速度更快，成本更低）", value=False)
+    speed_mode = st.radio("模型速度", ["自动（按模板时效）", "标准", "快速"], horizontal=True)
+    use_fast = {"标准": False, "快速": True}.get(speed_mode)
+    template_ratio = VIDEO_TEMPLATES[template_name]["ratio"]
+    derive_ratios = st.multiselect(
+        "派生画幅（本地 ffmpeg 转码，不额外计费）",
+        [ratio for ratio in RATIO_MAX_SIZE if ratio != video_ratio],
+        default=[template_ratio] if template_ratio != video_ratio else [],
+    )
     video_refs = []
     if product_images:
         video_refs = st.multiselect(
@@ -588,16 +732,30 @@ with video_tab:
         with st.spinner("VEO 3.1 视频生成中..."):
             final_prompt = video_prompt.strip()
             use_frames = bool(video_refs)
-            model_name = _pick_veo_model(video_ratio, use_frames=use_frames, use_fast=use_fast)
+            selector = _veo_selector()
+            model_name = selector.choose(
+                video_ratio,
+                use_frames,
+                VIDEO_TEMPLATES[template_name].get("slo_seconds"),
+                use_fast,
+            )
+            deadline = Deadline()
             try:
                 if len(video_refs) > 2:
                     st.info("VEO 3.1 帧转视频最多支持 2 张参考图，已取前两张。")
-                video_id = _apiyi_create_veo_task(final_prompt, model_name, image_files=video_refs[:2])
-                result = _apiyi_wait_for_veo(video_id)
+                selector.started(model_name)
+                started = time.monotonic()
+                elapsed = None
+                try:
+                    video_id = _apiyi_create_veo_task(final_prompt, model_name, deadline, image_files=video_refs[:2])
+                    result = _apiyi_wait_for_veo(video_id, deadline)
+                    elapsed = time.monotonic() - started
+                finally:
+                    selector.finished(model_name, elapsed)
                 video_url = result.get("url")
                 if not video_url:
                     raise ValueError("未获取到视频下载地址。")
-                video_bytes = _apiyi_download_video(video_url)
+                video_bytes = _apiyi_download_video(video_url, deadline)
                 st.session_state["last_video_versions"].append({
                     "model": model_name,
                     "video_id": video_id,
@@ -605,9 +763,22 @@ with video_tab:
                     "bytes": video_bytes,
                     "resolution": result.get("resolution"),
                     "duration": result.get("duration"),
+                    "derived": {},
                 })
             except Exception as exc:
                 st.error(f"视频生成失败：{exc}")
+            else:
+                if derive_ratios:
+                    # 与后端共用缓存写入路径：写 ETag 并按 VIDEO_CACHE_MB 淘汰
+                    cache_source(video_id, [video_bytes])
+                    futures = {ratio: submit_reframe(video_id, ratio) for ratio in derive_ratios}
+                    derived = st.session_state["last_video_versions"][-1]["derived"]
+                    for ratio, future in futures.items():
+                        try:
+                            with open(future.result(), "rb") as fh:
+                                derived[ratio] = fh.read()
+                        except Exception as exc:
+                            st.warning(f"{ratio} 转码失败：{exc}")
 
     if "last_video_versions" in st.session_state and st.session_state["last_video_versions"]:
         st.markdown("**高清下载**")
@@ -625,6 +796,14 @@ with video_tab:
                 file_name=f"veo_video_{model_name}.mp4",
                 mime="video/mp4",
             )
+            for ratio, derived_bytes in (item.get("derived") or {}).items():
+                st.download_button(
+                    f"下载 {ratio} 版本 (MP4)",
+                    data=derived_bytes,
+                    file_name=f"veo_video_{model_name}_{ratio.replace(':', 'x')}.mp4",
+                    mime="video/mp4",
+                    key=f"derived_{item['video_id']}_{ratio}",
+                )
 
     st.markdown("</div>", unsafe_allow_html=True)
 
@@ -638,6 +817,9 @@ with image_gen_tab:
         index=1,
     )
     image_size = st.selectbox("输出尺寸 (Pro 可用)", ["1K", "2K", "4K"], index=1)
+    candidate_count = st.number_input("候选数量", min_value=1, max_value=4, value=1, step=1)
+    use_hedge = st.toggle("对冲请求（长时间未返回时补发一次，降低等待，可能额外计费）", value=False)
+    derivative_names = st.multiselect("派生平台尺寸（本地渲染，不额外计费）", list(IMAGE_DERIVATIVES.keys()))
 
     prompt = st.text_area(
         "提示词",
@@ -646,24 +828,35 @@ with image_gen_tab:
     )
 
     if st.button("生成图片"):
+        st.session_state["last_image_derivatives"] = []
         try:
             with st.spinner("Nano Banana 生成图片中..."):
                 images, text, raw = _apiyi_generate_image(
                     prompt=prompt,
                     aspect_ratio=aspect_ratio,
                     image_size=image_size,
+                    candidate_count=int(candidate_count),
+                    with_text=response_text,
+                    hedge=use_hedge,
                 )
 
             if text:
                 st.code(text)
             if images:
-                for img in images:
-                    st.image(img, use_container_width=True)
+                for idx, img in enumerate(images, start=1):
+                    st.image(img, caption=f"结果 {idx}/{len(images)}", use_container_width=True)
+                if derivative_names:
+                    with st.spinner("渲染平台尺寸中..."):
+                        st.session_state["last_image_derivatives"] = _render_platform_derivatives(
+                            raw, derivative_names
+                        )
             else:
                 st.warning("未返回图片。可以尝试更明确的提示词或更换模型。")
         except Exception as exc:
             st.error(f"生成失败：{exc}")
 
+    _show_derivative_downloads("last_image_derivatives")
+
     st.markdown("</div>", unsafe_allow_html=True)
 
 with image_edit_tab:
@@ -690,8 +883,15 @@ with image_edit_tab:
             index=0,
         )
         edit_image_size = st.selectbox("输出尺寸 (Pro 可用)", ["1K", "2K", "4K"], index=1, key="edit_size")
+        edit_candidate_count = st.number_input(
+            "候选数量", min_value=1, max_value=4, value=1, step=1, key="edit_candidates"
+        )
+        edit_derivative_names = st.multiselect(
+            "派生平台尺寸（本地渲染，不额外计费）", list(IMAGE_DERIVATIVES.keys()), key="edit_derivatives"
+        )
 
         if st.button("开始修图"):
+            st.session_state["last_edit_derivatives"] = []
             try:
                 with st.spinner("Nano Banana 修图中..."):
                     images, text, raw = _apiyi_edit_image(
@@ -699,18 +899,27 @@ with image_edit_tab:
                         prompt=edit_prompt,
                         aspect_ratio=edit_aspect_ratio,
                         image_size=edit_image_size,
+                        candidate_count=int(edit_candidate_count),
+                        with_text=response_text,
                     )
 
                 if text:
                     st.code(text)
                 if images:
-                    for img in images:
-                        st.image(img, use_container_width=True)
+                    for idx, img in enumerate(images, start=1):
+                        st.image(img, caption=f"结果 {idx}/{len(images)}", use_container_width=True)
+                    if edit_derivative_names:
+                        with st.spinner("渲染平台尺寸中..."):
+                            st.session_state["last_edit_derivatives"] = _render_platform_derivatives(
+                                raw, edit_derivative_names
+                            )
                 else:
                     st.warning("未返回图片。可以尝试更明确的编辑指令或更换模型。")
             except Exception as exc:
                 st.error(f"修图失败：{exc}")
 
+        _show_derivative_downloads("last_edit_derivatives")
+
     st.markdown("</div>", unsafe_allow_html=True)
 
 
@@ -1,25 +1,81 @@
+import asyncio
 import base64
 import io
+import logging
 import os
 import time
-from typing import List, Optional
+import zipfile
+from typing import Iterator, List, Optional, Tuple
 
 import requests
-from fastapi import FastAPI, File, Form, UploadFile
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
+
+from deadline import Deadline, DeadlineExceeded, RequestCancelled, watch_disconnect
+from derivatives import derivative_filename, render_derivatives
+from endpoint_router import EndpointRouter, parse_bases
+from hedging import HedgePolicy
+from image_response import collect_texts, iter_inline_parts
+from key_pool import KeyPool, key_fingerprint, parse_keys
+from model_selector import VeoModelSelector
+from request_journal import build_journal
+from scheduler import AdmissionScheduler, SchedulerFull, build_scheduler
+from shared_state import get_state
+from templates import VIDEO_TEMPLATES
+from video_cache import VideoFileResponse, cache_source, cache_stats, fetch_lock, file_etag, touch
+from video_reframe import RATIO_MAX_SIZE, has_source, reframe_video, reframed_path, source_path, submit_reframe
 
 app = FastAPI()
+logger = logging.getLogger(__name__)
 
 APIYI_BASE = os.getenv("APIYI_BASE", "https://api.apiyi.com")
+# APIYI_BASES 支持配置多个网关地址，按实时延迟与错误率路由并自动故障转移
+ROUTER = EndpointRouter(
+    parse_bases(os.getenv("APIYI_BASES")) or [APIYI_BASE],
+    # 设置 UPSTREAM_JOURNAL 后记录每次上游调用，可用 replay.py 回放
+    journal=build_journal(),
+)
 APIYI_API_KEY = os.getenv("APIYI_API_KEY")
+# APIYI_API_KEYS 支持逗号/换行分隔的多个 key，未配置时回退到单个 APIYI_API_KEY
+# SHARED_STATE 配置为 sqlite:///path 时，多个 uvicorn worker 共享令牌桶、冷却、缓存与任务记录
+STATE = get_state()
+KEY_POOL = KeyPool(parse_keys(os.getenv("APIYI_API_KEYS")) or parse_keys(APIYI_API_KEY), state=STATE)
 
 IMAGE_MODEL = "gemini-3-pro-image-preview"
+# 与前端一致，单次最多 4 张候选图，避免单个请求放大上游费用
+MAX_CANDIDATES = 4
+
+# 图片与视频分开限流，长时间轮询的视频任务不会占满图片请求的并发
+IMAGE_SCHEDULER = build_scheduler(
+    int(os.getenv("IMAGE_MAX_INFLIGHT", "16")),
+    int(os.getenv("IMAGE_MAX_QUEUE", "64")),
+)
+VIDEO_SCHEDULER = build_scheduler(
+    int(os.getenv("VIDEO_MAX_INFLIGHT", "8")),
+    int(os.getenv("VIDEO_MAX_QUEUE", "32")),
+)
+
+
+HEDGE = HedgePolicy()
 
+# VEO 任务只能用创建它的 key 查询，任务记录中保存 key 指纹，任一 worker 都能继续查询
+VIDEO_JOB_TTL = int(os.getenv("VIDEO_JOB_TTL", str(7 * 86400)))
 
-def _require_api_key() -> str:
-    if not APIYI_API_KEY:
+
+def _require_api_key() -> KeyPool:
+    if not KEY_POOL:
         raise ValueError("缺少 APIYI_API_KEY，请在服务端环境变量中配置。")
-    return APIYI_API_KEY
+    return KEY_POOL
+
+
+def _update_job(video_id: str, **fields) -> dict:
+    return STATE.update(f"job:{video_id}", {**fields, "updated": time.time()}, ttl=VIDEO_JOB_TTL)
+
+
+def _video_key(video_id: str) -> Optional[str]:
+    job = STATE.get(f"job:{video_id}") or {}
+    return KEY_POOL.resolve(job.get("key"))
 
 
 def _pick_veo_model(video_ratio: str, use_frames: bool, use_fast: bool = False) -> str:
@@ -33,123 +89,304 @@ def _pick_veo_model(video_ratio: str, use_frames: bool, use_fast: bool = False)
     return model
 
 
-async def _apiyi_create_veo_task(prompt: str, model: str, images: Optional[List[UploadFile]] = None) -> str:
-    headers = {"Authorization": _require_api_key()}
-    if images:
-        files = []
-        for image in images[:2]:
-            image_bytes = await image.read()
-            if not image_bytes:
-                raise ValueError("参考图为空")
-            mime_type = image.content_type or "image/png"
-            files.append(("input_reference", (image.filename or "frame.png", image_bytes, mime_type)))
-        resp = requests.post(
-            f"{APIYI_BASE}/v1/videos",
-            headers=headers,
-            data={"prompt": prompt, "model": model},
-            files=files,
-            timeout=300,
-        )
-    else:
-        resp = requests.post(
-            f"{APIYI_BASE}/v1/videos",
-            headers={**headers, "Content-Type": "application/json"},
-            json={"prompt": prompt, "model": model},
-            timeout=300,
+VEO_SELECTOR = VeoModelSelector(_pick_veo_model)
+
+
+def _build_generation_config(
+    aspect_ratio: Optional[str],
+    image_size: Optional[str],
+    candidate_count: Optional[int] = None,
+    with_text: bool = False,
+) -> dict:
+    generation_config = {"responseModalities": ["TEXT", "IMAGE"] if with_text else ["IMAGE"]}
+    if candidate_count and candidate_count > 1:
+        generation_config["candidateCount"] = candidate_count
+    image_config = {}
+    if aspect_ratio:
+        image_config["aspectRatio"] = aspect_ratio
+    if image_size:
+        image_config["imageSize"] = image_size
+    if image_config:
+        generation_config["imageConfig"] = image_config
+    return generation_config
+
+
+def _image_response(data: dict, flatten: bool) -> JSONResponse:
+    images = [
+        {"candidate": index, "mime_type": mime_type, "data": encoded}
+        for index, mime_type, encoded in iter_inline_parts(data)
+    ]
+    headers = {"X-Image-Count": str(len(images))}
+    if flatten:
+        return JSONResponse({"images": images, "texts": collect_texts(data)}, headers=headers)
+    return JSONResponse(data, headers=headers)
+
+
+@app.exception_handler(DeadlineExceeded)
+async def _deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    return JSONResponse({"error": "请求超时", "raw": str(exc)}, status_code=504)
+
+
+@app.exception_handler(RequestCancelled)
+async def _request_cancelled_handler(request: Request, exc: RequestCancelled):
+    return JSONResponse({"error": "请求已取消", "raw": str(exc)}, status_code=499)
+
+
+@app.exception_handler(SchedulerFull)
+async def _scheduler_full_handler(request: Request, exc: SchedulerFull):
+    return JSONResponse(
+        {"error": "服务繁忙", "raw": str(exc)},
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+def _request_deadline(request: Request) -> Deadline:
+    return Deadline.from_header(request.headers.get("X-Request-Timeout"))
+
+
+def _request_lane(request: Request) -> str:
+    return (request.headers.get("X-Priority") or "interactive").strip().lower()
+
+
+def _request_tenant(request: Request) -> str:
+    tenant = request.headers.get("X-Tenant") or request.headers.get("X-API-Key")
+    if tenant:
+        return tenant
+    return request.client.host if request.client else "anonymous"
+
+
+async def _run_until_deadline(
+    request: Request,
+    deadline: Deadline,
+    scheduler: AdmissionScheduler,
+    func,
+    *args,
+):
+    # 阻塞的上游调用放到线程池，同时监听客户端断开，断开后由 deadline 通知各阶段停止
+    watcher = asyncio.create_task(watch_disconnect(request, deadline))
+    try:
+        async with scheduler.slot(_request_lane(request), _request_tenant(request), deadline):
+            return await run_in_threadpool(func, *args)
+    finally:
+        watcher.cancel()
+
+
+async def _read_frames(images: List[UploadFile]) -> List[Tuple[str, bytes, str]]:
+    frames = []
+    for image in images[:2]:
+        image_bytes = await image.read()
+        if not image_bytes:
+            raise ValueError("参考图为空")
+        frames.append((image.filename or "frame.png", image_bytes, image.content_type or "image/png"))
+    return frames
+
+
+def _apiyi_generate_content(payload: dict, deadline: Deadline, timeout: int, route: str, skip: int = 0) -> dict:
+    with _require_api_key().lease(deadline) as lease:
+        resp = ROUTER.request(
+            "POST",
+            f"/v1beta/models/{IMAGE_MODEL}:generateContent",
+            route=route,
+            deadline=deadline,
+            timeout=timeout,
+            skip=skip,
+            headers={"Authorization": f"Bearer {lease.key}", "Content-Type": "application/json"},
+            json=payload,
         )
+        lease.report(resp)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def _apiyi_generate_content_hedged(
+    payload: dict,
+    deadline: Deadline,
+    timeout: int,
+    route: str,
+    hedge_key: str,
+) -> dict:
+    # 超过该尺寸历史延迟的分位数仍未返回时，向另一网关补发一次，先成功者胜出
+    return HEDGE.run(
+        hedge_key,
+        lambda attempt_deadline, attempt: _apiyi_generate_content(
+            payload, attempt_deadline, timeout, route, skip=attempt
+        ),
+        deadline,
+    )
+
+
+def _apiyi_create_veo_task(
+    prompt: str,
+    model: str,
+    deadline: Deadline,
+    frames: Optional[List[Tuple[str, bytes, str]]] = None,
+) -> str:
+    with _require_api_key().lease(deadline) as lease:
+        headers = {"Authorization": lease.key}
+        if frames:
+            resp = ROUTER.request(
+                "POST",
+                "/v1/videos",
+                route="veo_create",
+                deadline=deadline,
+                timeout=300,
+                headers=headers,
+                data={"prompt": prompt, "model": model},
+                files=[("input_reference", frame) for frame in frames],
+            )
+        else:
+            resp = ROUTER.request(
+                "POST",
+                "/v1/videos",
+                route="veo_create",
+                deadline=deadline,
+                timeout=300,
+                headers={**headers, "Content-Type": "application/json"},
+                json={"prompt": prompt, "model": model},
+            )
+        lease.report(resp)
     resp.raise_for_status()
     payload = resp.json()
     video_id = payload.get("id")
     if not video_id:
         raise ValueError("创建任务失败，未返回 video_id")
+    _update_job(video_id, key=key_fingerprint(lease.key), model=model, status="created", created=time.time())
     return video_id
 
 
-def _apiyi_get_veo_status(video_id: str) -> dict:
-    resp = requests.get(
-        f"{APIYI_BASE}/v1/videos/{video_id}",
-        headers={"Authorization": _require_api_key()},
-        timeout=120,
-    )
+def _apiyi_get_veo_status(video_id: str, deadline: Deadline) -> dict:
+    with _require_api_key().lease(deadline, prefer=_video_key(video_id)) as lease:
+        resp = ROUTER.request(
+            "GET",
+            f"/v1/videos/{video_id}",
+            route="veo_status",
+            deadline=deadline,
+            timeout=120,
+            headers={"Authorization": lease.key},
+        )
+        lease.report(resp)
     resp.raise_for_status()
     return resp.json()
 
 
-def _apiyi_get_veo_content(video_id: str) -> dict:
-    resp = requests.get(
-        f"{APIYI_BASE}/v1/videos/{video_id}/content",
-        headers={"Authorization": _require_api_key()},
-        timeout=120,
-    )
+def _apiyi_get_veo_content(video_id: str, deadline: Deadline) -> dict:
+    with _require_api_key().lease(deadline, prefer=_video_key(video_id)) as lease:
+        resp = ROUTER.request(
+            "GET",
+            f"/v1/videos/{video_id}/content",
+            route="veo_content",
+            deadline=deadline,
+            timeout=120,
+            headers={"Authorization": lease.key},
+        )
+        lease.report(resp)
     resp.raise_for_status()
     return resp.json()
 
 
-def _apiyi_wait_for_veo(video_id: str, timeout: int = 900, interval: int = 6) -> dict:
+def _apiyi_wait_for_veo(video_id: str, deadline: Deadline, timeout: int = 900, interval: int = 6) -> dict:
     start = time.time()
+    last_status = None
     while time.time() - start < timeout:
-        status_data = _apiyi_get_veo_status(video_id)
+        status_data = _apiyi_get_veo_status(video_id, deadline)
         status = status_data.get("status")
+        if status != last_status:
+            last_status = status
+            _update_job(video_id, status=status)
         if status == "completed":
-            return _apiyi_get_veo_content(video_id)
+            return _apiyi_get_veo_content(video_id, deadline)
         if status == "failed":
+            _update_job(video_id, error=str(status_data)[:500])
             raise ValueError(f"视频生成失败：{status_data}")
-        time.sleep(interval)
+        deadline.sleep(interval)
     raise TimeoutError("等待视频生成超时")
 
 
+def _iter_video_download(url: str, deadline: Deadline) -> Iterator[bytes]:
+    start = time.monotonic()
+    status = None
+    received = 0
+    try:
+        with requests.get(url, timeout=deadline.timeout(600), stream=True) as resp:
+            status = resp.status_code
+            resp.raise_for_status()
+            for chunk in resp.iter_content(chunk_size=1 << 16):
+                deadline.check()
+                received += len(chunk)
+                yield chunk
+    except (requests.Timeout, requests.ConnectionError):
+        # iter_content 把流式读超时包装成 ConnectionError；截止时间已到时统一按 DeadlineExceeded 处理
+        deadline.check()
+        raise
+    finally:
+        journal = ROUTER.journal
+        if journal is not None:
+            journal.record(
+                "GET",
+                url,
+                "veo_download",
+                status=status,
+                latency=time.monotonic() - start,
+                response_bytes=received,
+            )
+
+
 @app.post("/image_generate")
 async def image_generate(
+    request: Request,
     prompt: str = Form(...),
     aspect_ratio: Optional[str] = Form(None),
     image_size: Optional[str] = Form(None),
+    candidate_count: Optional[int] = Form(None),
+    response_text: bool = Form(False),
+    flatten: bool = Form(False),
+    hedge: bool = Form(False),
 ):
-    key = _require_api_key()
-    endpoint = f"{APIYI_BASE}/v1beta/models/{IMAGE_MODEL}:generateContent"
-    generation_config = {"responseModalities": ["IMAGE"]}
-    image_config = {}
-    if aspect_ratio:
-        image_config["aspectRatio"] = aspect_ratio
-    if image_size:
-        image_config["imageSize"] = image_size
-    if image_config:
-        generation_config["imageConfig"] = image_config
+    if candidate_count is not None and not 1 <= candidate_count <= MAX_CANDIDATES:
+        return JSONResponse({"error": f"candidate_count 取值范围为 1-{MAX_CANDIDATES}"}, status_code=400)
+    _require_api_key()
+    deadline = _request_deadline(request)
+    generation_config = _build_generation_config(aspect_ratio, image_size, candidate_count, response_text)
 
     payload = {
         "contents": [{"parts": [{"text": prompt}]}],
         "generationConfig": generation_config,
     }
-    resp = requests.post(
-        endpoint,
-        headers={"Authorization": f"Bearer {key}", "Content-Type": "application/json"},
-        json=payload,
-        timeout=300,
-    )
-    resp.raise_for_status()
-    return JSONResponse(resp.json())
+    # 网关延迟按操作与尺寸分别统计，1K 与 4K 的耗时相差数倍，混在一起会误判离群节点
+    route = f"image_generate:{image_size or '1K'}"
+    if hedge:
+        hedge_key = f"{IMAGE_MODEL}:{image_size or '1K'}"
+        data = await _run_until_deadline(
+            request, deadline, IMAGE_SCHEDULER, _apiyi_generate_content_hedged, payload, deadline, 300, route, hedge_key
+        )
+    else:
+        data = await _run_until_deadline(
+            request, deadline, IMAGE_SCHEDULER, _apiyi_generate_content, payload, deadline, 300, route
+        )
+    return _image_response(data, flatten)
 
 
 @app.post("/image_edit")
 async def image_edit(
+    request: Request,
     image: UploadFile = File(...),
     prompt: str = Form(...),
     aspect_ratio: Optional[str] = Form(None),
     image_size: Optional[str] = Form(None),
+    candidate_count: Optional[int] = Form(None),
+    response_text: bool = Form(False),
+    flatten: bool = Form(False),
 ):
-    key = _require_api_key()
+    if candidate_count is not None and not 1 <= candidate_count <= MAX_CANDIDATES:
+        return JSONResponse({"error": f"candidate_count 取值范围为 1-{MAX_CANDIDATES}"}, status_code=400)
+    _require_api_key()
+    deadline = _request_deadline(request)
     image_bytes = await image.read()
     b64 = base64.b64encode(image_bytes).decode("utf-8")
     mime_type = image.content_type or "image/png"
 
-    endpoint = f"{APIYI_BASE}/v1beta/models/{IMAGE_MODEL}:generateContent"
-    generation_config = {"responseModalities": ["IMAGE"]}
-    image_config = {}
-    if aspect_ratio:
-        image_config["aspectRatio"] = aspect_ratio
-    if image_size:
-        image_config["imageSize"] = image_size
-    if image_config:
-        generation_config["imageConfig"] = image_config
+    generation_config = _build_generation_config(aspect_ratio, image_size, candidate_count, response_text)
 
     payload = {
         "contents": [{
@@ -160,38 +397,251 @@ async def image_edit(
         }],
         "generationConfig": generation_config,
     }
-    resp = requests.post(
-        endpoint,
-        headers={"Authorization": f"Bearer {key}", "Content-Type": "application/json"},
-        json=payload,
-        timeout=360,
+    route = f"image_edit:{image_size or '1K'}"
+    data = await _run_until_deadline(
+        request, deadline, IMAGE_SCHEDULER, _apiyi_generate_content, payload, deadline, 360, route
     )
-    resp.raise_for_status()
-    return JSONResponse(resp.json())
+    return _image_response(data, flatten)
+
+
+@app.post("/image_derivatives")
+async def image_derivatives(
+    image: UploadFile = File(...),
+    platforms: Optional[List[str]] = Form(None),
+):
+    image_bytes = await image.read()
+    try:
+        rendered = await run_in_threadpool(render_derivatives, image_bytes, platforms)
+    except ValueError as exc:
+        return JSONResponse({"error": str(exc)}, status_code=400)
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+        for name, (data, _) in rendered.items():
+            archive.writestr(derivative_filename(name), data)
+    # 整包一次发送；StreamingResponse 迭代 BytesIO 会按换行符切块
+    return Response(
+        buffer.getvalue(),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="derivatives.zip"'},
+    )
+
+
+def _run_video_pipeline(
+    prompt: str,
+    model: str,
+    frames: List[Tuple[str, bytes, str]],
+    deadline: Deadline,
+) -> Tuple[str, dict, Optional[str]]:
+    VEO_SELECTOR.started(model)
+    start = time.monotonic()
+    elapsed = None
+    try:
+        video_id = _apiyi_create_veo_task(prompt, model, deadline, frames=frames)
+        try:
+            result = _apiyi_wait_for_veo(video_id, deadline)
+            elapsed = time.monotonic() - start
+            video_url = result.get("url")
+            if not video_url:
+                return video_id, result, None
+            # 直接写入本地缓存，之后 /videos/{id} 的重复下载不再回源
+            with fetch_lock(video_id, deadline):
+                path = cache_source(video_id, _iter_video_download(video_url, deadline))
+            _update_job(video_id, cached=True)
+            return video_id, result, path
+        except RequestCancelled:
+            # 上游任务已付费，记录 video_id，之后可通过 /videos/{id} 取回
+            logger.info("client disconnected, abandoned video task %s", video_id)
+            raise
+    finally:
+        VEO_SELECTOR.finished(model, elapsed)
 
 
 @app.post("/generate_video")
 async def generate_video(
+    request: Request,
     image: Optional[List[UploadFile]] = File(None),
     prompt: str = Form(...),
     video_ratio: str = Form("16:9"),
-    use_fast: bool = Form(False),
+    use_fast: Optional[bool] = Form(None),
+    derive_ratios: Optional[List[str]] = Form(None),
+    template: Optional[str] = Form(None),
 ):
     images = image or []
     use_frames = bool(images)
-    model = _pick_veo_model(video_ratio, use_frames=use_frames, use_fast=use_fast)
+    derive_ratios = list(derive_ratios or [])
+    slo_seconds = None
+    if template:
+        if template not in VIDEO_TEMPLATES:
+            return JSONResponse({"error": f"未知模板：{template}"}, status_code=400)
+        config = VIDEO_TEMPLATES[template]
+        slo_seconds = config.get("slo_seconds")
+        if config["ratio"] != video_ratio and config["ratio"] not in derive_ratios:
+            derive_ratios.append(config["ratio"])
+    # 画幅在付费生成之前校验，避免视频生成后才因转码参数报错
+    unsupported = [ratio for ratio in derive_ratios if ratio != video_ratio and ratio not in RATIO_MAX_SIZE]
+    if unsupported:
+        return JSONResponse(
+            {"error": f"不支持的画幅：{', '.join(unsupported)}（可选 {', '.join(RATIO_MAX_SIZE)}）"},
+            status_code=400,
+        )
+    # 未显式指定 use_fast 时，按模板时效与各型号实测耗时、排队数自动选择
+    model = VEO_SELECTOR.choose(video_ratio, use_frames, slo_seconds, use_fast)
+    deadline = _request_deadline(request)
     try:
-        video_id = await _apiyi_create_veo_task(prompt, model, images=images)
-        result = _apiyi_wait_for_veo(video_id)
-        video_url = result.get("url")
-        if not video_url:
+        frames = await _read_frames(images)
+        video_id, result, path = await _run_until_deadline(
+            request, deadline, VIDEO_SCHEDULER, _run_video_pipeline, prompt, model, frames, deadline
+        )
+        if not path:
             return JSONResponse({"error": "未获取到视频地址", "raw": result}, status_code=502)
-        video_resp = requests.get(video_url, timeout=600)
-        video_resp.raise_for_status()
-        return StreamingResponse(
-            io.BytesIO(video_resp.content),
-            media_type="video/mp4",
-            headers={"X-Video-Model": model, "X-Video-Id": video_id},
+        derived = []
+        for ratio in dict.fromkeys(derive_ratios):
+            if ratio == video_ratio:
+                continue
+            try:
+                submit_reframe(video_id, ratio)
+            except Exception:
+                # 视频已生成并缓存，转码提交失败不影响返回原视频
+                logger.exception("failed to submit reframe %s for video %s", ratio, video_id)
+                continue
+            derived.append(ratio)
+        return VideoFileResponse(
+            path,
+            await run_in_threadpool(file_etag, path),
+            headers={
+                "X-Video-Model": model,
+                "X-Video-Id": video_id,
+                "X-Derived-Ratios": ",".join(derived),
+            },
         )
+    except (DeadlineExceeded, RequestCancelled, SchedulerFull):
+        raise
     except Exception as exc:
         return JSONResponse({"error": "生成失败", "raw": str(exc)}, status_code=502)
+
+
+def _fetch_video_source(video_id: str, deadline: Deadline) -> None:
+    with fetch_lock(video_id, deadline):
+        if has_source(video_id):
+            return
+        result = _apiyi_get_veo_content(video_id, deadline)
+        video_url = result.get("url")
+        if not video_url:
+            raise ValueError("未获取到视频地址")
+        cache_source(video_id, _iter_video_download(video_url, deadline))
+    _update_job(video_id, cached=True)
+
+
+@app.api_route("/videos/{video_id}", methods=["GET", "HEAD"])
+async def get_video(request: Request, video_id: str):
+    try:
+        path = source_path(video_id)
+    except ValueError as exc:
+        return JSONResponse({"error": str(exc)}, status_code=400)
+    if not has_source(video_id):
+        # 未命中本地缓存时回源下载一次，签名地址过期也能通过 video_id 重新获取
+        deadline = _request_deadline(request)
+        try:
+            await _run_until_deadline(request, deadline, VIDEO_SCHEDULER, _fetch_video_source, video_id, deadline)
+        except (DeadlineExceeded, RequestCancelled, SchedulerFull):
+            raise
+        except Exception as exc:
+            return JSONResponse({"error": "视频获取失败", "raw": str(exc)}, status_code=502)
+    touch(video_id)
+    return VideoFileResponse(
+        path,
+        await run_in_threadpool(file_etag, path),
+        filename=f"veo_{video_id}.mp4",
+        headers={"X-Video-Id": video_id},
+    )
+
+
+@app.get("/videos/{video_id}/reframe")
+async def reframe(request: Request, video_id: str, ratio: str = "1:1"):
+    try:
+        # 先校验 video_id 与画幅，参数非法时不回源下载
+        reframed_path(video_id, ratio)
+    except ValueError as exc:
+        return JSONResponse({"error": "转码失败", "raw": str(exc)}, status_code=400)
+    deadline = _request_deadline(request)
+    try:
+        if not has_source(video_id):
+            # 与 /videos/{id} 一致，只有回源下载才占用视频并发名额
+            await _run_until_deadline(request, deadline, VIDEO_SCHEDULER, _fetch_video_source, video_id, deadline)
+        path = await run_in_threadpool(reframe_video, video_id, ratio)
+    except (DeadlineExceeded, RequestCancelled, SchedulerFull):
+        raise
+    except ValueError as exc:
+        return JSONResponse({"error": "转码失败", "raw": str(exc)}, status_code=400)
+    except Exception as exc:
+        return JSONResponse({"error": "转码失败", "raw": str(exc)}, status_code=502)
+    touch(video_id)
+    return VideoFileResponse(
+        path,
+        await run_in_threadpool(file_etag, path),
+        filename=f"veo_{video_id}_{ratio.replace(':', 'x')}.mp4",
+        headers={"X-Video-Id": video_id, "X-Video-Ratio": ratio},
+    )
+
+
+@app.get("/scheduler")
+async def scheduler_stats():
+    return {"image": IMAGE_SCHEDULER.snapshot(), "video": VIDEO_SCHEDULER.snapshot()}
+
+
+@app.get("/keys")
+async def key_stats():
+    return {"keys": KEY_POOL.snapshot()}
+
+
+@app.get("/endpoints")
+async def endpoint_stats():
+    return {"endpoints": ROUTER.snapshot()}
+
+
+@app.get("/jobs/{video_id}")
+async def job_status(video_id: str):
+    job = await run_in_threadpool(STATE.get, f"job:{video_id}")
+    if not job:
+        return JSONResponse({"error": f"未找到任务：{video_id}"}, status_code=404)
+    # key 指纹只用于内部路由，不对外返回
+    return {key: value for key, value in job.items() if key != "key"}
+
+
+@app.get("/state")
+async def state_stats():
+    return await run_in_threadpool(STATE.stats)
+
+
+@app.get("/video_cache")
+async def video_cache_stats():
+    return await run_in_threadpool(cache_stats)
+
+
+@app.get("/journal")
+async def journal_stats():
+    return ROUTER.journal.snapshot() if ROUTER.journal else {"path": None}
+
+
+@app.get("/hedging")
+async def hedging_stats():
+    return HEDGE.snapshot()
+
+
+@app.get("/templates")
+async def list_templates(
+    platform: Optional[str] = None,
+    ratio: Optional[str] = None,
+    duration: Optional[int] = None,
+):
+    names = VIDEO_TEMPLATES.find(platform=platform, ratio=ratio, duration=duration)
+    return {
+        "templates": {name: VIDEO_TEMPLATES[name] for name in names},
+        "error": VIDEO_TEMPLATES.last_error or None,
+    }
+
+
+@app.get("/models")
+async def model_stats():
+    return {"veo": VEO_SELECTOR.snapshot()}
@@ -0,0 +1,311 @@
+# bench_memory.py
+# 大负载内存峰值回归基准：本地假上游 + 每个场景/并发度独立子进程，记录峰值 RSS 与 tracemalloc 分配
+import argparse
+import asyncio
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from base64 import b64encode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ["image_generate", "image_edit", "image_derivatives", "generate_video"]
+METRICS = ["rss_delta_mb", "child_peak_rss_mb", "tracemalloc_peak_mb", "per_request_peak_mb", "net_kb"]
+
+
+def _rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    # Linux 下 ru_maxrss 单位为 KB，macOS 为字节；RUSAGE_CHILDREN 只统计已退出并被回收的子进程
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _synthetic_png(width: int = 3840, height: int = 2160) -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.effect_noise((width, height), 64).convert("RGB").save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def _variant(png: bytes, tag: str) -> bytes:
+    # 在 IHDR 之后插入一个 tEXt 块，像素不变但内容哈希不同，避免命中衍生图缓存
+    data = b"bench\x00" + tag.encode("ascii")
+    chunk = len(data).to_bytes(4, "big") + b"tEXt" + data + zlib.crc32(b"tEXt" + data).to_bytes(4, "big")
+    return png[:33] + chunk + png[33:]
+
+
+def _start_fake_upstream(image_mb: float, video_mb: float, candidates: int) -> str:
+    image_b64 = b64encode(os.urandom(int(image_mb * 1024 * 1024))).decode("ascii")
+    generate_body = json.dumps({
+        "candidates": [
+            {"content": {"parts": [{"inlineData": {"mimeType": "image/png", "data": image_b64}}]}}
+            for _ in range(candidates)
+        ]
+    }).encode("utf-8")
+    video_size = int(video_mb * 1024 * 1024)
+    video_chunk = os.urandom(1 << 20)
+    counter = {"next": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _json(self, payload, body: Optional[bytes] = None) -> None:
+            body = body if body is not None else json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            remaining = length
+            while remaining:
+                remaining -= len(self.rfile.read(min(remaining, 1 << 20)))
+            if self.path.endswith(":generateContent"):
+                self._json(None, generate_body)
+            elif self.path == "/v1/videos":
+                with lock:
+                    counter["next"] += 1
+                    video_id = f"bench-{os.getpid()}-{counter['next']}"
+                self._json({"id": video_id})
+            else:
+                self.send_error(404)
+
+        def do_GET(self):
+            host = self.headers.get("Host")
+            if self.path.startswith("/files/"):
+                self.send_response(200)
+                self.send_header("Content-Type", "video/mp4")
+                self.send_header("Content-Length", str(video_size))
+                self.end_headers()
+                sent = 0
+                while sent < video_size:
+                    chunk = video_chunk[: min(len(video_chunk), video_size - sent)]
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+            elif self.path.endswith("/content"):
+                video_id = self.path.split("/")[3]
+                self._json({"url": f"http://{host}/files/{video_id}.mp4", "resolution": "1080p", "duration": 8})
+            elif self.path.startswith("/v1/videos/"):
+                self._json({"status": "completed"})
+            else:
+                self.send_error(404)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _build_request(scenario: str, upload: bytes) -> dict:
+    if scenario == "image_generate":
+        return {"url": "/image_generate", "data": {"prompt": "bench", "image_size": "4K"}}
+    if scenario == "image_edit":
+        return {
+            "url": "/image_edit",
+            "data": {"prompt": "bench", "image_size": "4K"},
+            "files": {"image": ("bench.png", upload, "image/png")},
+        }
+    if scenario == "image_derivatives":
+        return {"url": "/image_derivatives", "files": {"image": ("bench.png", upload, "image/png")}}
+    if scenario == "generate_video":
+        return {"url": "/generate_video", "data": {"prompt": "bench", "video_ratio": "16:9"}}
+    raise ValueError(f"未知场景：{scenario}")
+
+
+async def _drive(app, scenario: str, concurrency: int, upload: bytes, tag: str) -> List[int]:
+    import httpx
+
+    # 每个请求上传不同的字节，衍生图等按内容哈希缓存的路径每次都真实计算
+    specs = [
+        _build_request(scenario, _variant(upload, f"{tag}-{index}") if upload else upload)
+        for index in range(concurrency)
+    ]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        async def _one(spec: dict) -> int:
+            resp = await client.post(spec["url"], data=spec.get("data"), files=spec.get("files"))
+            await resp.aread()
+            return resp.status_code
+
+        return await asyncio.gather(*(_one(spec) for spec in specs))
+
+
+def run_worker(scenario: str, concurrency: int, args) -> dict:
+    # 视频缓存与调用日志写在临时目录，测量结束后连同目录一起删除
+    with tempfile.TemporaryDirectory(prefix="bench_video_") as cache_dir:
+        return _measure(scenario, concurrency, args, cache_dir)
+
+
+def _measure(scenario: str, concurrency: int, args, cache_dir: str) -> dict:
+    base = _start_fake_upstream(args.image_mb, args.video_mb, args.candidates)
+    os.environ.update({
+        "APIYI_BASES": base,
+        "APIYI_API_KEYS": "bench-key",
+        "KEY_RATE_PER_MIN": "1000000",
+        "KEY_BURST": "100000",
+        "IMAGE_MAX_INFLIGHT": str(max(16, concurrency)),
+        "VIDEO_MAX_INFLIGHT": str(max(8, concurrency)),
+        "VIDEO_CACHE_DIR": cache_dir,
+        # 开启上游调用日志，把逐请求的记录开销计入基准
+        "UPSTREAM_JOURNAL": os.path.join(cache_dir, "upstream_journal.jsonl"),
+    })
+    sys.path.insert(0, ROOT)
+    import backend_api
+
+    upload = _synthetic_png() if scenario in ("image_edit", "image_derivatives") else b""
+    # 预热一次，排除导入与首次初始化的分配
+    asyncio.run(_drive(backend_api.app, scenario, 1, upload, "warmup"))
+
+    rss_before = _rss_mb()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    statuses = asyncio.run(_drive(backend_api.app, scenario, concurrency, upload, "run"))
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    import derivatives
+
+    # 衍生图在子进程中渲染，关闭进程池并回收后 RUSAGE_CHILDREN 才包含其峰值
+    if derivatives._pool is not None:
+        derivatives._pool.shutdown(wait=True)
+    if backend_api.ROUTER.journal is not None:
+        backend_api.ROUTER.journal.close()
+
+    diff = after.compare_to(before, "lineno")
+    top = [
+        {"where": str(stat.traceback[0]), "kb": round(stat.size_diff / 1024, 1), "blocks": stat.count_diff}
+        for stat in sorted(diff, key=lambda item: item.size_diff, reverse=True)[:5]
+    ]
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "statuses": sorted(set(statuses)),
+        "wall_s": round(wall, 3),
+        "peak_rss_mb": round(_rss_mb(), 1),
+        "rss_delta_mb": round(_rss_mb() - rss_before, 1),
+        "child_peak_rss_mb": round(_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        "tracemalloc_peak_mb": round(peak / (1024 * 1024), 1),
+        "per_request_peak_mb": round(peak / (1024 * 1024) / concurrency, 1),
+        "net_blocks": sum(stat.count_diff for stat in diff),
+        "net_kb": round(sum(stat.size_diff for stat in diff) / 1024, 1),
+        "top_allocations": top,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def _load_results(ref: str, out_dir: str) -> dict:
+    path = ref if os.path.exists(ref) else os.path.join(out_dir, f"{ref}.json")
+    with open(path, "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[str]:
+    previous = {(item["scenario"], item["concurrency"]): item for item in baseline["results"]}
+    regressions = []
+    print(f"\n对比基线 {baseline.get('commit')} -> {current.get('commit')}")
+    for item in current["results"]:
+        old = previous.get((item["scenario"], item["concurrency"]))
+        if not old:
+            continue
+        for metric in METRICS:
+            before, after = old.get(metric, 0), item.get(metric, 0)
+            change = (after - before) / before if before else 0.0
+            flag = ""
+            # 小于 1 MB / 64 KB 的绝对变化视为噪声
+            noise = 64 if metric == "net_kb" else 1.0
+            if change > threshold and after - before > noise:
+                flag = "  <-- 回归"
+                regressions.append(f"{item['scenario']} x{item['concurrency']} {metric}: {before} -> {after}")
+            print(f"  {item['scenario']:<18} x{item['concurrency']:<3} {metric:<20} {before:>10} -> {after:>10} ({change:+.1%}){flag}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="大负载内存峰值回归基准")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,4,8")
+    parser.add_argument("--image-mb", type=float, default=12.0, help="假上游返回的单张图片大小")
+    parser.add_argument("--video-mb", type=float, default=40.0, help="假上游返回的视频大小")
+    parser.add_argument("--candidates", type=int, default=1)
+    parser.add_argument("--out-dir", default=os.path.join(ROOT, "bench_results"))
+    parser.add_argument("--compare", help="基线 commit 或结果文件路径")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    parser.add_argument("--worker", nargs=2, metavar=("SCENARIO", "CONCURRENCY"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker[0], int(args.worker[1]), args)))
+        return 0
+
+    results = []
+    for scenario in [item for item in args.scenarios.split(",") if item]:
+        for concurrency in [int(item) for item in args.concurrency.split(",") if item]:
+            cmd = [
+                sys.executable, os.path.abspath(__file__),
+                "--worker", scenario, str(concurrency),
+                "--image-mb", str(args.image_mb),
+                "--video-mb", str(args.video_mb),
+                "--candidates", str(args.candidates),
+            ]
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"{scenario} x{concurrency} 失败：\n{proc.stderr[-2000:]}", file=sys.stderr)
+                return 1
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            results.append(result)
+            print(
+                f"{scenario:<18} x{concurrency:<3} rss+{result['rss_delta_mb']:>7} MB  "
+                f"child {result['child_peak_rss_mb']:>7} MB  "
+                f"tracemalloc peak {result['tracemalloc_peak_mb']:>7} MB  "
+                f"per request {result['per_request_peak_mb']:>6} MB  {result['wall_s']}s  {result['statuses']}"
+            )
+
+    report: Dict = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "params": {"image_mb": args.image_mb, "video_mb": args.video_mb, "candidates": args.candidates},
+        "results": results,
+    }
+    os.makedirs(args.out_dir, exist_ok=True)
+    out_path = os.path.join(args.out_dir, f"{report['commit']}.json")
+    with open(out_path, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {out_path}")
+
+    if args.compare:
+        regressions = compare(_load_results(args.compare, args.out_dir), report, args.threshold)
+        if regressions:
+            print("\n发现内存回归：\n" + "\n".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
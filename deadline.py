@@ -0,0 +1,66 @@
+# deadline.py
+import asyncio
+import os
+import threading
+import time
+from typing import Optional
+
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "1200"))
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds: float = REQUEST_DEADLINE):
+        self.expires_at = time.monotonic() + seconds
+        self._cancelled = threading.Event()
+        self.reason = ""
+
+    @classmethod
+    def from_header(cls, value: Optional[str], default: float = REQUEST_DEADLINE) -> "Deadline":
+        # 客户端只能缩短服务端的截止时间，不能延长
+        try:
+            requested = float(value) if value else default
+        except ValueError:
+            requested = default
+        return cls(max(1.0, min(requested, default)))
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self, reason: str = "客户端已断开") -> None:
+        self.reason = reason
+        self._cancelled.set()
+
+    def check(self) -> None:
+        if self._cancelled.is_set():
+            raise RequestCancelled(self.reason)
+        if self.remaining() <= 0:
+            raise DeadlineExceeded("请求已超过截止时间")
+
+    def timeout(self, cap: float) -> float:
+        self.check()
+        return min(cap, self.remaining())
+
+    def sleep(self, seconds: float) -> None:
+        self.check()
+        self._cancelled.wait(min(seconds, self.remaining()))
+        self.check()
+
+
+async def watch_disconnect(request, deadline: Deadline, interval: float = 1.0) -> None:
+    while not deadline.cancelled:
+        if await request.is_disconnected():
+            deadline.cancel()
+            return
+        await asyncio.sleep(interval)
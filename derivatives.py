@@ -0,0 +1,134 @@
+# derivatives.py
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from shared_state import get_state
+from templates import IMAGE_DERIVATIVES
+
+DERIVATIVE_WORKERS = int(os.getenv("DERIVATIVE_WORKERS", "0")) or None
+# 渲染结果存入 SharedState 的可淘汰缓存，总大小由 SHARED_STATE_CACHE_MB 控制
+DERIVATIVE_CACHE_TTL = int(os.getenv("DERIVATIVE_CACHE_TTL", "86400"))
+
+_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+_EXTENSIONS = {"JPEG": "jpg", "WEBP": "webp", "PNG": "png"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn 避免在 Streamlit / uvicorn 的多线程进程中 fork
+            _pool = ProcessPoolExecutor(
+                max_workers=DERIVATIVE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _crop_box(width: int, height: int, target_w: int, target_h: int) -> Tuple[float, float, float, float]:
+    target_ratio = target_w / target_h
+    if width / height > target_ratio:
+        crop_w = height * target_ratio
+        left = (width - crop_w) / 2
+        return left, 0, left + crop_w, height
+    crop_h = width / target_ratio
+    top = (height - crop_h) / 2
+    return 0, top, width, top + crop_h
+
+
+def _flatten(img: Image.Image, fmt: str) -> Image.Image:
+    if fmt == "JPEG" and img.mode != "RGB":
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    if img.mode not in ("RGB", "RGBA"):
+        return img.convert("RGBA")
+    return img
+
+
+def _render_one(source: Image.Image, spec: dict) -> bytes:
+    fmt = spec.get("format", "JPEG")
+    target_w, target_h = spec["size"]
+    fit = spec.get("fit", "crop")
+    img = _flatten(source, fmt)
+    width, height = img.size
+    if fit == "width":
+        target_h = max(1, round(height * target_w / width))
+        out = img.resize((target_w, target_h), Image.LANCZOS, reducing_gap=3.0)
+    elif fit == "pad":
+        scale = min(target_w / width, target_h / height)
+        inner = (max(1, round(width * scale)), max(1, round(height * scale)))
+        resized = img.resize(inner, Image.LANCZOS, reducing_gap=3.0)
+        fill = (255, 255, 255, 0) if resized.mode == "RGBA" else (255, 255, 255)
+        out = Image.new(resized.mode, (target_w, target_h), fill)
+        out.paste(resized, ((target_w - inner[0]) // 2, (target_h - inner[1]) // 2))
+    else:
+        box = _crop_box(width, height, target_w, target_h)
+        out = img.resize((target_w, target_h), Image.LANCZOS, box=box, reducing_gap=3.0)
+
+    buffer = io.BytesIO()
+    save_kwargs = {"quality": spec.get("quality", 90)}
+    if fmt == "JPEG":
+        save_kwargs.update(optimize=True, progressive=True)
+    elif fmt == "WEBP":
+        save_kwargs["method"] = 4
+    out.save(buffer, format=fmt, **save_kwargs)
+    return buffer.getvalue()
+
+
+def _render_many(image_bytes: bytes, specs: Dict[str, dict]) -> Dict[str, bytes]:
+    # 每张源图只传给子进程一次、只解码一次，所有尺寸共用解码结果
+    with Image.open(io.BytesIO(image_bytes)) as src:
+        source = ImageOps.exif_transpose(src)
+        source.load()
+    return {name: _render_one(source, spec) for name, spec in specs.items()}
+
+
+def _cache_key(digest: str, name: str) -> str:
+    return f"derivative:{digest}:{name}"
+
+
+def derivative_filename(name: str, stem: str = "image") -> str:
+    fmt = IMAGE_DERIVATIVES[name].get("format", "JPEG")
+    slug = "_".join(name.lower().replace(":", "x").split())
+    return f"{stem}_{slug}.{_EXTENSIONS.get(fmt, 'img')}"
+
+
+def render_derivatives(image_bytes: bytes, names: Optional[Iterable[str]] = None) -> Dict[str, Tuple[bytes, str]]:
+    if not image_bytes:
+        raise ValueError("源图片为空，无法生成平台尺寸。")
+    names = list(names) if names else list(IMAGE_DERIVATIVES.keys())
+    unknown = [name for name in names if name not in IMAGE_DERIVATIVES]
+    if unknown:
+        raise ValueError(f"未知的平台尺寸：{', '.join(unknown)}")
+
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    results: Dict[str, bytes] = {}
+    pending = {}
+    for name in names:
+        cached = get_state().get(_cache_key(digest, name))
+        if cached is not None:
+            results[name] = cached
+        else:
+            pending[name] = IMAGE_DERIVATIVES[name]
+    if pending:
+        rendered = _get_pool().submit(_render_many, image_bytes, pending).result()
+        for name, data in rendered.items():
+            get_state().set(_cache_key(digest, name), data, ttl=DERIVATIVE_CACHE_TTL, evictable=True)
+            results[name] = data
+
+    return {
+        name: (results[name], _MIME_TYPES.get(IMAGE_DERIVATIVES[name].get("format", "JPEG"), "application/octet-stream"))
+        for name in names
+    }
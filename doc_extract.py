@@ -0,0 +1,260 @@
+# doc_extract.py
+import hashlib
+import io
+import multiprocessing
+import os
+import queue
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeout, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional, Set, Tuple
+from xml.etree import ElementTree
+
+DOC_WORKERS = int(os.getenv("DOC_WORKERS", "2"))
+DOC_TIMEOUT = float(os.getenv("DOC_TIMEOUT", "15"))
+# 后台全文解析的单文档超时，超时后重建 full 进程池，后续任务不会被卡住
+DOC_FULL_TIMEOUT = float(os.getenv("DOC_FULL_TIMEOUT", "120"))
+DOC_PREVIEW_CHARS = int(os.getenv("DOC_PREVIEW_CHARS", "800"))
+DOC_CACHE_ITEMS = int(os.getenv("DOC_CACHE_ITEMS", "64"))
+
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+# 预览与全文分开两个进程池，后台全文解析不会挡住新文档的预览
+_pools: Dict[str, ProcessPoolExecutor] = {}
+_pool_lock = threading.Lock()
+# 预览任务所属的进程池，以及已退役进程池中超时的任务
+_preview_jobs: Dict[Future, ProcessPoolExecutor] = {}
+_stuck: Dict[ProcessPoolExecutor, Set[Future]] = {}
+_cache: "OrderedDict[Tuple[str, Optional[int]], Future]" = OrderedDict()
+_cache_lock = threading.Lock()
+_full_jobs: "queue.Queue[Tuple[bytes, str, Future]]" = queue.Queue()
+_full_thread: Optional[threading.Thread] = None
+
+
+def _extract_pdf(data: bytes, budget: Optional[int]) -> str:
+    from pypdf import PdfReader  # type: ignore
+
+    reader = PdfReader(io.BytesIO(data))
+    chunks = []
+    total = 0
+    # reader.pages 按需解析，达到字数预算后剩余页面不再处理
+    for page in reader.pages:
+        text = page.extract_text() or ""
+        chunks.append(text)
+        total += len(text) + 1
+        if budget is not None and total >= budget:
+            break
+    return "\n".join(chunks)
+
+
+def _extract_docx(data: bytes, budget: Optional[int]) -> str:
+    # 流式读取 word/document.xml，不构建完整文档树
+    paragraphs = []
+    total = 0
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        with archive.open("word/document.xml") as xml_file:
+            parts = []
+            for event, elem in ElementTree.iterparse(xml_file, events=("end",)):
+                if elem.tag == f"{_W_NS}t":
+                    parts.append(elem.text or "")
+                elif elem.tag == f"{_W_NS}tab":
+                    parts.append("\t")
+                elif elem.tag == f"{_W_NS}p":
+                    paragraph = "".join(parts)
+                    parts = []
+                    paragraphs.append(paragraph)
+                    total += len(paragraph) + 1
+                    elem.clear()
+                    if budget is not None and total >= budget:
+                        break
+    return "\n".join(paragraphs)
+
+
+def _extract_plain(data: bytes, budget: Optional[int]) -> str:
+    if budget is not None:
+        # UTF-8 单字符最多 4 字节，截断处的半个字符由 errors="ignore" 丢弃
+        data = data[: budget * 4]
+    return data.decode("utf-8", errors="ignore")
+
+
+def _extract(data: bytes, name: str, budget: Optional[int]) -> Tuple[str, str]:
+    name = (name or "").lower()
+    if name.endswith(".pdf"):
+        try:
+            text = _extract_pdf(data, budget)
+        except Exception as exc:
+            return "", f"PDF 解析失败：{exc}"
+    elif name.endswith(".docx"):
+        try:
+            text = _extract_docx(data, budget)
+        except Exception as exc:
+            return "", f"DOCX 解析失败：{exc}"
+    else:
+        try:
+            text = _extract_plain(data, budget)
+        except Exception:
+            return "", "文档解析失败，请转换为 TXT / PDF / DOCX。"
+    text = text.strip()
+    if budget is not None:
+        text = text[:budget]
+    return text, ""
+
+
+def _get_pool(kind: str) -> ProcessPoolExecutor:
+    with _pool_lock:
+        pool = _pools.get(kind)
+        if pool is None:
+            # spawn 避免在 Streamlit / uvicorn 的多线程进程中 fork
+            workers = DOC_WORKERS if kind == "preview" else 1
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pools[kind] = pool
+        return pool
+
+
+def _reset_pool(kind: str) -> None:
+    # 超时的任务无法单独取消，直接结束整个进程池，下次调用时重建
+    with _pool_lock:
+        pool = _pools.pop(kind, None)
+    if pool is None:
+        return
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit_to_pool(kind: str, data: bytes, name: str, budget: Optional[int]) -> Future:
+    try:
+        pool = _get_pool(kind)
+        future = pool.submit(_extract, data, name, budget)
+    except BrokenProcessPool:
+        _reset_pool(kind)
+        pool = _get_pool(kind)
+        future = pool.submit(_extract, data, name, budget)
+    if kind == "preview":
+        with _pool_lock:
+            _preview_jobs[future] = pool
+        future.add_done_callback(_forget_preview)
+    return future
+
+
+def _forget_preview(future: Future) -> None:
+    with _pool_lock:
+        _preview_jobs.pop(future, None)
+
+
+def _retire_preview(future: Future) -> None:
+    # 预览池由多个会话共用，超时后不立即结束：新任务改用新池，旧池等其余任务完成后再回收
+    with _pool_lock:
+        pool = _preview_jobs.get(future)
+        if pool is None:
+            return
+        if _pools.get("preview") is pool:
+            del _pools["preview"]
+        first = pool not in _stuck
+        _stuck.setdefault(pool, set()).add(future)
+    if first:
+        threading.Thread(target=_reap_preview, args=(pool,), name="doc-reap", daemon=True).start()
+
+
+def _reap_preview(pool: ProcessPoolExecutor) -> None:
+    while True:
+        with _pool_lock:
+            others = [job for job, owner in _preview_jobs.items() if owner is pool and job not in _stuck[pool]]
+        if not others:
+            break
+        # 其余任务都由各自调用方的超时兜底，要么完成，要么同样被标记为超时
+        wait(others, timeout=1)
+    with _pool_lock:
+        _stuck.pop(pool, None)
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _run_full_jobs() -> None:
+    # 全文任务逐个提交，超时从任务真正开始执行时计算，而不是从排队时计算
+    while True:
+        data, name, future = _full_jobs.get()
+        if not future.set_running_or_notify_cancel():
+            continue
+        try:
+            future.set_result(_submit_to_pool("full", data, name, None).result(timeout=DOC_FULL_TIMEOUT))
+        except FutureTimeout:
+            _reset_pool("full")
+            future.set_result(("", f"文档全文解析超时（>{DOC_FULL_TIMEOUT:.0f}s），请精简文档或转换为 TXT。"))
+        except Exception as exc:
+            future.set_exception(exc)
+
+
+def _submit_full(data: bytes, name: str) -> Future:
+    global _full_thread
+    future: Future = Future()
+    _full_jobs.put((data, name, future))
+    if _full_thread is None or not _full_thread.is_alive():
+        _full_thread = threading.Thread(target=_run_full_jobs, name="doc-full", daemon=True)
+        _full_thread.start()
+    return future
+
+
+def _cache_key(data: bytes, budget: Optional[int]) -> Tuple[str, Optional[int]]:
+    return hashlib.sha256(data).hexdigest(), budget
+
+
+def _cache_put(key: Tuple[str, Optional[int]], future: Future) -> None:
+    _cache[key] = future
+    while len(_cache) > DOC_CACHE_ITEMS:
+        _cache.popitem(last=False)
+
+
+def _submit(data: bytes, name: str, budget: Optional[int]) -> Tuple[Tuple[str, Optional[int]], Future]:
+    key = _cache_key(data, budget)
+    with _cache_lock:
+        future = _cache.get(key)
+        if future is not None and not (future.done() and future.exception() is not None):
+            _cache.move_to_end(key)
+            return key, future
+        if budget is None:
+            future = _submit_full(data, name)
+        else:
+            future = _submit_to_pool("preview", data, name, budget)
+        _cache_put(key, future)
+        return key, future
+
+
+def extract_text(
+    data: bytes,
+    name: str,
+    budget: Optional[int] = DOC_PREVIEW_CHARS,
+    timeout: float = DOC_TIMEOUT,
+) -> Tuple[str, str]:
+    if not data:
+        return "", ""
+    key, future = _submit(data, name, budget)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        _retire_preview(future)
+        result = ("", f"文档解析超时（>{timeout:.0f}s），请精简文档或转换为 TXT。")
+        # 记住超时结果，页面刷新时不再重复解析同一份文档
+        timed_out: Future = Future()
+        timed_out.set_result(result)
+        with _cache_lock:
+            _cache_put(key, timed_out)
+        return result
+    except Exception as exc:
+        return "", f"文档解析失败：{exc}"
+
+
+def submit_full_text(data: bytes, name: str) -> Future:
+    # 全文在后台解析，供后续需要完整内容的场景使用
+    return _submit(data, name, None)[1]
+
+
+def full_text_if_ready(data: bytes, name: str) -> Optional[str]:
+    future = submit_full_text(data, name)
+    if not future.done() or future.exception() is not None:
+        return None
+    text, warning = future.result()
+    return None if warning else text
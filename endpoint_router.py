@@ -0,0 +1,232 @@
+# endpoint_router.py
+import os
+import random
+import re
+import statistics
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from deadline import Deadline
+from request_journal import RequestJournal, body_size
+
+ROUTER_ALPHA = float(os.getenv("ROUTER_ALPHA", "0.2"))
+ROUTER_EJECT_AFTER = int(os.getenv("ROUTER_EJECT_AFTER", "3"))
+ROUTER_EJECT_SECONDS = float(os.getenv("ROUTER_EJECT_SECONDS", "30"))
+ROUTER_OUTLIER_FACTOR = float(os.getenv("ROUTER_OUTLIER_FACTOR", "3"))
+ROUTER_EXPLORE = float(os.getenv("ROUTER_EXPLORE", "0.05"))
+
+# 网关本身不可用时才切换节点；生成类请求超时可能已在上游计费，不自动重放
+_FAILOVER_STATUS = {502, 503}
+
+
+def _is_connect_error(exc: Exception) -> bool:
+    # 只有连接尚未建立时才能安全换节点；请求体发出后的断连（Connection aborted）可能已在上游计费
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    reason = exc.args[0] if exc.args else None
+    reason = getattr(reason, "reason", reason)
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+def parse_bases(value) -> List[str]:
+    if not value:
+        return []
+    items: Iterable[str] = re.split(r"[\s,;]+", value) if isinstance(value, str) else value
+    bases = []
+    for item in items:
+        item = str(item).strip().rstrip("/")
+        if item and item not in bases:
+            bases.append(item)
+    return bases
+
+
+class _EndpointState:
+    def __init__(self, base: str):
+        self.base = base
+        self.latency: Dict[str, float] = {}
+        self.error_rate = 0.0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.inflight = 0
+        self.requests = 0
+
+
+class EndpointRouter:
+    def __init__(
+        self,
+        bases: Iterable[str],
+        alpha: float = ROUTER_ALPHA,
+        eject_after: int = ROUTER_EJECT_AFTER,
+        eject_seconds: float = ROUTER_EJECT_SECONDS,
+        outlier_factor: float = ROUTER_OUTLIER_FACTOR,
+        explore: float = ROUTER_EXPLORE,
+        journal: Optional[RequestJournal] = None,
+    ):
+        self.alpha = alpha
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.outlier_factor = outlier_factor
+        self.explore = explore
+        self.journal = journal
+        self._states = [_EndpointState(base) for base in parse_bases(list(bases))]
+        if not self._states:
+            raise ValueError("缺少 APIYI_BASE，请至少配置一个接口地址。")
+        self._lock = threading.Lock()
+
+    @property
+    def bases(self) -> List[str]:
+        return [state.base for state in self._states]
+
+    def _score(self, state: _EndpointState, route: str) -> float:
+        # 未测过的节点按 0 延迟处理，保证每个节点都会被探测到
+        latency = state.latency.get(route, 0.0)
+        return latency * (1 + 4 * state.error_rate) * (1 + 0.1 * state.inflight)
+
+    def ranked(self, route: str = "default") -> List[str]:
+        now = time.monotonic()
+        with self._lock:
+            healthy = [state for state in self._states if state.ejected_until <= now]
+            ejected = sorted(
+                (state for state in self._states if state.ejected_until > now),
+                key=lambda item: item.ejected_until,
+            )
+            healthy.sort(key=lambda item: self._score(item, route))
+            if len(healthy) > 1 and random.random() < self.explore:
+                healthy.insert(0, healthy.pop(random.randrange(1, len(healthy))))
+        # 全部被摘除时仍按恢复时间依次尝试，不直接拒绝请求
+        return [state.base for state in healthy + ejected]
+
+    def _state(self, base: str) -> Optional[_EndpointState]:
+        for state in self._states:
+            if state.base == base:
+                return state
+        return None
+
+    def record(self, base: str, route: str, latency: float, ok: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(base)
+            if state is None:
+                return
+            state.requests += 1
+            state.error_rate = (1 - self.alpha) * state.error_rate + self.alpha * (0.0 if ok else 1.0)
+            if ok:
+                state.failures = 0
+                previous = state.latency.get(route)
+                state.latency[route] = latency if previous is None else (1 - self.alpha) * previous + self.alpha * latency
+            else:
+                state.failures += 1
+                if state.failures >= self.eject_after:
+                    state.ejected_until = now + self.eject_seconds
+                    state.failures = 0
+                    return
+            self._eject_outlier(state, route, now)
+
+    def _eject_outlier(self, state: _EndpointState, route: str, now: float) -> None:
+        peers = [
+            other.latency[route]
+            for other in self._states
+            if other is not state and other.ejected_until <= now and route in other.latency
+        ]
+        latency = state.latency.get(route)
+        if not peers or latency is None:
+            return
+        if latency > self.outlier_factor * statistics.median(peers):
+            state.ejected_until = now + self.eject_seconds
+            # 恢复后重新测量，不沿用被摘除时的高延迟
+            state.latency.pop(route, None)
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        route: str = "default",
+        deadline: Optional[Deadline] = None,
+        timeout: float = 120,
+        skip: int = 0,
+        **kwargs,
+    ) -> requests.Response:
+        last_exc: Optional[Exception] = None
+        bases = self.ranked(route)
+        if skip and len(bases) > 1:
+            # 对冲等并行请求从排名靠后的节点开始，避免与主请求挤在同一网关
+            skip %= len(bases)
+            bases = bases[skip:] + bases[:skip]
+        for position, base in enumerate(bases):
+            is_last = position == len(bases) - 1
+            attempt_timeout = deadline.timeout(timeout) if deadline else timeout
+            state = self._state(base)
+            with self._lock:
+                state.inflight += 1
+            start = time.monotonic()
+            try:
+                resp = requests.request(method, f"{base}{path}", timeout=attempt_timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                self._journal(method, base, path, route, kwargs, start, error=type(exc).__name__)
+                # 截止时间到期或请求被取消（如对冲落败）造成的超时不是网关故障，不计入错误率
+                if deadline is None or not (deadline.cancelled or deadline.remaining() <= 0):
+                    self.record(base, route, time.monotonic() - start, ok=False)
+                if deadline is not None:
+                    # 读超时被截止时间截断时按 DeadlineExceeded 抛出，由上层返回 504
+                    deadline.check()
+                if not _is_connect_error(exc):
+                    raise
+                last_exc = exc
+                continue
+            finally:
+                with self._lock:
+                    state.inflight -= 1
+            ok = resp.status_code < 500
+            self.record(base, route, time.monotonic() - start, ok=ok)
+            self._journal(method, base, path, route, kwargs, start, resp=resp)
+            if resp.status_code in _FAILOVER_STATUS and not is_last:
+                resp.close()
+                continue
+            return resp
+        raise last_exc or requests.ConnectionError("所有接口地址均不可用")
+
+    def _journal(
+        self,
+        method: str,
+        base: str,
+        path: str,
+        route: str,
+        kwargs: dict,
+        start: float,
+        resp: Optional[requests.Response] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        if self.journal is None:
+            return
+        self.journal.record(
+            method,
+            f"{base}{path}",
+            route,
+            kwargs,
+            status=resp.status_code if resp is not None else None,
+            latency=time.monotonic() - start,
+            # 未开启 stream 时响应体已读入内存，取长度不额外产生 IO
+            response_bytes=len(resp.content) if resp is not None and not kwargs.get("stream") else None,
+            error=error,
+            # 直接取 requests 实际发送的请求体长度，与线上字节数一致
+            request_bytes=body_size(resp.request.body) if resp is not None else None,
+        )
+
+    def snapshot(self) -> List[dict]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "base": state.base,
+                    "latency": {route: round(value, 3) for route, value in state.latency.items()},
+                    "error_rate": round(state.error_rate, 3),
+                    "inflight": state.inflight,
+                    "ejected": round(max(0.0, state.ejected_until - now), 1),
+                    "requests": state.requests,
+                }
+                for state in self._states
+            ]
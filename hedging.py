@@ -0,0 +1,131 @@
+# hedging.py
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Deque, Dict, Optional
+
+from deadline import Deadline
+
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.9"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "5"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "45"))
+HEDGE_BUDGET_RATIO = float(os.getenv("HEDGE_BUDGET_RATIO", "0.1"))
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", "32"))
+
+_MIN_SAMPLES = 20
+
+
+class HedgePolicy:
+    def __init__(
+        self,
+        percentile: float = HEDGE_PERCENTILE,
+        min_delay: float = HEDGE_MIN_DELAY,
+        default_delay: float = HEDGE_DEFAULT_DELAY,
+        budget_ratio: float = HEDGE_BUDGET_RATIO,
+        window: int = 200,
+        max_workers: int = HEDGE_WORKERS,
+    ):
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self.budget_ratio = budget_ratio
+        self.window = window
+        # 每个主请求积累 budget_ratio 个令牌，一次对冲消耗 1 个，对冲量不超过主请求的 budget_ratio
+        self._budget = 1.0
+        self._budget_cap = max(1.0, budget_ratio * 50)
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.requests = 0
+
+    def delay(self, key: str) -> float:
+        with self._lock:
+            samples = sorted(self._samples.get(key) or ())
+        if len(samples) < _MIN_SAMPLES:
+            return self.default_delay
+        index = min(len(samples) - 1, int(len(samples) * self.percentile))
+        return max(self.min_delay, samples[index])
+
+    def record(self, key: str, latency: float) -> None:
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(latency)
+
+    def _earn(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self._budget = min(self._budget_cap, self._budget + self.budget_ratio)
+
+    def _spend(self) -> bool:
+        with self._lock:
+            if self._budget < 1:
+                return False
+            self._budget -= 1
+            self.hedged += 1
+            return True
+
+    def run(
+        self,
+        key: str,
+        func: Callable[[Deadline, int], object],
+        deadline: Deadline,
+        is_success: Callable[[object], bool] = lambda result: True,
+    ):
+        # func(attempt_deadline, attempt)：attempt 为 0 表示主请求，1 表示对冲请求
+        self._earn()
+        attempts = []
+        started = time.monotonic()
+
+        def _submit(attempt: int) -> Future:
+            attempt_deadline = Deadline(deadline.remaining())
+            future = self._pool.submit(func, attempt_deadline, attempt)
+            attempts.append((future, attempt_deadline, attempt))
+            return future
+
+        primary = _submit(0)
+        hedge_at = started + self.delay(key)
+        hedge_pending = True
+        pending = {primary}
+        first_outcome: Optional[Future] = None
+        try:
+            while pending:
+                deadline.check()
+                now = time.monotonic()
+                if hedge_pending and now >= hedge_at:
+                    hedge_pending = False
+                    if self._spend():
+                        pending.add(_submit(1))
+                timeout = min(1.0, max(deadline.remaining(), 0.01))
+                if hedge_pending:
+                    timeout = min(timeout, max(hedge_at - now, 0.01))
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if first_outcome is None:
+                        first_outcome = future
+                    if future.exception() is None and is_success(future.result()):
+                        self.record(key, time.monotonic() - started)
+                        if future is not primary:
+                            with self._lock:
+                                self.hedge_wins += 1
+                        return future.result()
+            return first_outcome.result()
+        finally:
+            # 落败的请求只能在下一个检查点停止，正在进行的 socket 读取会在自身超时后结束，结果被丢弃
+            for future, attempt_deadline, _ in attempts:
+                if not future.done():
+                    attempt_deadline.cancel("对冲请求已由另一路完成")
+                    future.cancel()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            keys = list(self._samples)
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "budget": round(self._budget, 2),
+            "delays": {key: round(self.delay(key), 2) for key in keys},
+        }
@@ -0,0 +1,43 @@
+# image_response.py
+import base64
+from typing import Iterator, List, Tuple
+
+
+def _iter_parts(data: dict) -> Iterator[Tuple[int, dict]]:
+    if not isinstance(data, dict):
+        return
+    for index, candidate in enumerate(data.get("candidates") or []):
+        if not isinstance(candidate, dict):
+            continue
+        content = candidate.get("content") or {}
+        for part in content.get("parts") or []:
+            if isinstance(part, dict):
+                yield index, part
+
+
+def iter_inline_parts(data: dict) -> Iterator[Tuple[int, str, str]]:
+    # 遍历所有 candidate 的所有图片 part，保持 base64 原文不解码
+    for index, part in _iter_parts(data):
+        inline = part.get("inlineData") or part.get("inline_data") or {}
+        encoded = inline.get("data")
+        if not encoded:
+            continue
+        mime_type = inline.get("mimeType") or inline.get("mime_type") or "image/png"
+        yield index, mime_type, encoded
+
+
+def iter_inline_images(data: dict) -> Iterator[Tuple[int, str, bytes]]:
+    # 按需逐张解码，调用方不消费就不会占用解码后的内存
+    for index, mime_type, encoded in iter_inline_parts(data):
+        yield index, mime_type, base64.b64decode(encoded)
+
+
+def collect_texts(data: dict) -> List[str]:
+    texts = []
+    for _, part in _iter_parts(data):
+        if part.get("thought"):
+            continue
+        text = part.get("text")
+        if text and text.strip():
+            texts.append(text.strip())
+    return texts
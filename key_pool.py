@@ -0,0 +1,208 @@
+# key_pool.py
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+from deadline import Deadline
+from scheduler import SchedulerFull
+from shared_state import MemoryState, SharedState
+
+KEY_RATE_PER_MIN = float(os.getenv("KEY_RATE_PER_MIN", "60"))
+KEY_BURST = float(os.getenv("KEY_BURST", "10"))
+KEY_COOLDOWN = float(os.getenv("KEY_COOLDOWN", "30"))
+KEY_INVALID_COOLDOWN = float(os.getenv("KEY_INVALID_COOLDOWN", "600"))
+# 等待 key 冷却的上限，超过后直接返回 503，不占着并发名额空等
+KEY_MAX_WAIT = float(os.getenv("KEY_MAX_WAIT", "30"))
+
+_QUOTA_HINTS = ("quota", "insufficient", "exceeded", "余额", "额度")
+
+
+def parse_keys(value) -> List[str]:
+    if not value:
+        return []
+    if isinstance(value, str):
+        items: Iterable[str] = re.split(r"[\s,;]+", value)
+    else:
+        items = value
+    keys = []
+    for item in items:
+        item = str(item).strip()
+        if item and item not in keys:
+            keys.append(item)
+    return keys
+
+
+def key_fingerprint(key: str) -> str:
+    # 共享状态与任务记录中只保存指纹，不落盘明文 key
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+class _KeyState:
+    # 令牌桶与冷却状态在 SharedState 中跨 worker 共享，这里只保留本进程的统计
+    def __init__(self, key: str):
+        self.key = key
+        self.fingerprint = key_fingerprint(key)
+        self.inflight = 0
+        self.requests = 0
+        self.throttled = 0
+
+
+class KeyLease:
+    def __init__(self, pool: "KeyPool", key: str):
+        self.pool = pool
+        self.key = key
+        self.status_code: Optional[int] = None
+        self.retry_after: Optional[float] = None
+        self.body = ""
+
+    def report(self, response) -> None:
+        self.status_code = response.status_code
+        if response.status_code >= 400:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                self.retry_after = float(retry_after)
+            try:
+                self.body = response.text[:500]
+            except Exception:
+                self.body = ""
+
+
+class KeyPool:
+    def __init__(
+        self,
+        keys: Iterable[str],
+        rate_per_min: float = KEY_RATE_PER_MIN,
+        burst: float = KEY_BURST,
+        cooldown: float = KEY_COOLDOWN,
+        state: Optional[SharedState] = None,
+    ):
+        self.rate = rate_per_min / 60.0
+        self.burst = burst
+        self.cooldown = cooldown
+        self.state = state or MemoryState()
+        self._states: Dict[str, _KeyState] = {key: _KeyState(key) for key in parse_keys(list(keys))}
+        self._by_fingerprint = {state.fingerprint: state.key for state in self._states.values()}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def resolve(self, key_or_fingerprint: Optional[str]) -> Optional[str]:
+        if not key_or_fingerprint:
+            return None
+        if key_or_fingerprint in self._states:
+            return key_or_fingerprint
+        return self._by_fingerprint.get(key_or_fingerprint)
+
+    def _cooldown(self, state: _KeyState) -> dict:
+        return self.state.get(f"keypool:cooldown:{state.fingerprint}") or {}
+
+    def _try_take(self, prefer: Optional[str]) -> tuple:
+        now = time.time()
+        prefer = self.resolve(prefer)
+        with self._lock:
+            states = [self._states[prefer]] if prefer else list(self._states.values())
+            # 优先选本进程在途请求最少的 key
+            states.sort(key=lambda item: (item.inflight, item.requests))
+        waits = []
+        invalid = 0
+        for state in states:
+            cooldown = self._cooldown(state)
+            cooldown_until = cooldown.get("until", 0.0)
+            if cooldown_until > now:
+                waits.append(cooldown_until - now)
+                invalid += 1 if cooldown.get("invalid") else 0
+                continue
+            wait = self.state.take_token(f"keypool:bucket:{state.fingerprint}", self.rate, self.burst)
+            if wait <= 0:
+                with self._lock:
+                    state.inflight += 1
+                    state.requests += 1
+                return state.key, 0.0, False
+            waits.append(wait)
+        return None, min(waits), invalid == len(states)
+
+    def acquire(self, deadline: Optional[Deadline] = None, prefer: Optional[str] = None) -> str:
+        if not self._states:
+            raise ValueError("缺少 APIYI_API_KEY，请配置至少一个 API Key。")
+        deadline = deadline or Deadline()
+        while True:
+            key, wait, all_invalid = self._try_take(prefer)
+            if key:
+                return key
+            if all_invalid:
+                raise SchedulerFull(math.ceil(wait), "所有 API Key 均被上游拒绝（401），请检查 APIYI_API_KEYS 配置。")
+            if wait > min(deadline.remaining(), KEY_MAX_WAIT):
+                raise SchedulerFull(max(1, math.ceil(wait)))
+            deadline.sleep(max(wait, 0.05))
+
+    def release(self, lease: KeyLease) -> None:
+        state = self._states.get(lease.key)
+        if state is None:
+            return
+        with self._lock:
+            state.inflight = max(0, state.inflight - 1)
+        status = lease.status_code
+        if status is None:
+            return
+        now = time.time()
+        name = f"keypool:cooldown:{state.fingerprint}"
+        body = lease.body.lower()
+        if status == 429 or status == 402 or (status == 403 and any(hint in body for hint in _QUOTA_HINTS)):
+            with self._lock:
+                state.throttled += 1
+            strikes = self._cooldown(state).get("strikes", 0) + 1
+            backoff = max(self.cooldown * (2 ** min(strikes - 1, 4)), lease.retry_after or 0)
+            # 连续失败次数比冷却时间保留得更久，用于指数退避
+            self.state.set(name, {"until": now + backoff, "strikes": strikes}, ttl=backoff + self.cooldown * 16)
+            self.state.drain_tokens(f"keypool:bucket:{state.fingerprint}")
+        elif status == 401:
+            strikes = self._cooldown(state).get("strikes", 0) + 1
+            self.state.set(
+                name,
+                {"until": now + KEY_INVALID_COOLDOWN, "strikes": strikes, "invalid": True},
+                ttl=KEY_INVALID_COOLDOWN,
+            )
+        elif status < 400:
+            cooldown = self._cooldown(state)
+            if cooldown.get("strikes"):
+                if cooldown.get("until", 0.0) > now:
+                    self.state.set(name, {"until": cooldown["until"], "strikes": 0}, ttl=cooldown["until"] - now)
+                else:
+                    self.state.delete(name)
+
+    def _ready(self, state: _KeyState, now: float) -> bool:
+        if self._cooldown(state).get("until", 0.0) > now:
+            return False
+        return self.state.tokens(f"keypool:bucket:{state.fingerprint}", self.rate, self.burst) >= 1
+
+    def has_ready_key(self) -> bool:
+        now = time.time()
+        return any(self._ready(state, now) for state in list(self._states.values()))
+
+    @contextmanager
+    def lease(self, deadline: Optional[Deadline] = None, prefer: Optional[str] = None):
+        lease = KeyLease(self, self.acquire(deadline, prefer))
+        try:
+            yield lease
+        finally:
+            self.release(lease)
+
+    def snapshot(self) -> List[dict]:
+        now = time.time()
+        items = []
+        for state in list(self._states.values()):
+            items.append({
+                "key": f"{state.key[:4]}…{state.key[-4:]}" if len(state.key) > 8 else "****",
+                "tokens": round(self.state.tokens(f"keypool:bucket:{state.fingerprint}", self.rate, self.burst), 2),
+                "inflight": state.inflight,
+                "cooldown": round(max(0.0, self._cooldown(state).get("until", 0.0) - now), 1),
+                "requests": state.requests,
+                "throttled": state.throttled,
+            })
+        return items
@@ -0,0 +1,76 @@
+# model_selector.py
+import os
+import threading
+from typing import Callable, Dict, Optional
+
+VEO_STANDARD_PRIOR = float(os.getenv("VEO_STANDARD_PRIOR", "300"))
+VEO_FAST_PRIOR = float(os.getenv("VEO_FAST_PRIOR", "120"))
+VEO_MODEL_CONCURRENCY = int(os.getenv("VEO_MODEL_CONCURRENCY", "4"))
+
+
+class VeoModelSelector:
+    # 按各型号实测耗时与当前排队数估算交付时间，标准版赶不上模板时效时自动换成 -fast
+    def __init__(
+        self,
+        namer: Callable[[str, bool, bool], str],
+        standard_prior: float = VEO_STANDARD_PRIOR,
+        fast_prior: float = VEO_FAST_PRIOR,
+        concurrency: int = VEO_MODEL_CONCURRENCY,
+        alpha: float = 0.2,
+    ):
+        self.namer = namer
+        self.standard_prior = standard_prior
+        self.fast_prior = fast_prior
+        self.concurrency = max(1, concurrency)
+        self.alpha = alpha
+        self._latency: Dict[str, float] = {}
+        self._inflight: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def started(self, model: str) -> None:
+        with self._lock:
+            self._inflight[model] = self._inflight.get(model, 0) + 1
+
+    def finished(self, model: str, seconds: Optional[float] = None) -> None:
+        with self._lock:
+            self._inflight[model] = max(0, self._inflight.get(model, 0) - 1)
+            if seconds is not None:
+                previous = self._latency.get(model)
+                if previous is not None:
+                    seconds = (1 - self.alpha) * previous + self.alpha * seconds
+                self._latency[model] = seconds
+
+    def expected(self, model: str, fast: bool) -> float:
+        with self._lock:
+            latency = self._latency.get(model, self.fast_prior if fast else self.standard_prior)
+            queued = self._inflight.get(model, 0)
+        return latency * (1 + queued / self.concurrency)
+
+    def choose(
+        self,
+        video_ratio: str,
+        use_frames: bool,
+        slo_seconds: Optional[float] = None,
+        use_fast: Optional[bool] = None,
+    ) -> str:
+        if use_fast is not None:
+            return self.namer(video_ratio, use_frames, use_fast)
+        standard = self.namer(video_ratio, use_frames, False)
+        if slo_seconds is None:
+            return standard
+        fast = self.namer(video_ratio, use_frames, True)
+        expected_standard = self.expected(standard, fast=False)
+        if expected_standard <= slo_seconds:
+            return standard
+        return fast if self.expected(fast, fast=True) < expected_standard else standard
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            models = set(self._latency) | set(self._inflight)
+            return {
+                model: {
+                    "latency": round(self._latency[model], 1) if model in self._latency else None,
+                    "inflight": self._inflight.get(model, 0),
+                }
+                for model in sorted(models)
+            }
@@ -0,0 +1,227 @@
+# replay.py
+# 按 upstream_journal.jsonl 的时间线重放上游调用：本地替身按记录的状态码、延迟与响应大小应答
+import argparse
+import hashlib
+import json
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import requests
+
+from request_journal import OMITTED_PREFIX, read_journal
+
+_CHUNK = 1 << 16
+
+
+def _filler(length: int, seed: str) -> str:
+    # 同一条记录每次生成相同内容，保证回放可复现
+    block = hashlib.sha256(seed.encode("utf-8")).hexdigest()
+    return (block * (length // len(block) + 1))[:length]
+
+
+def _expand(value, seed: str):
+    if isinstance(value, str) and value.startswith(OMITTED_PREFIX) and value.endswith(">"):
+        return _filler(int(value[len(OMITTED_PREFIX):-1]), seed)
+    if isinstance(value, dict):
+        return {key: _expand(item, f"{seed}/{key}") for key, item in value.items()}
+    if isinstance(value, list):
+        return [_expand(item, f"{seed}/{pos}") for pos, item in enumerate(value)]
+    return value
+
+
+def build_request(entry: dict, index: int) -> dict:
+    seed = f"{index}:{entry.get('prompt_sha256')}"
+    files = entry.get("files") or []
+    kwargs: Dict = {}
+    if files:
+        kwargs["files"] = [
+            ("input_reference", (f"frame{pos}.png", _filler(size, f"{seed}/file{pos}").encode("ascii"), "image/png"))
+            for pos, size in enumerate(files)
+        ]
+    if "payload" in entry:
+        body = _expand(entry["payload"], seed)
+    elif entry.get("body"):
+        # 未记录请求体时按记录的大小合成，字段与模型保持一致
+        size = max(0, (entry.get("request_bytes") or 0) - sum(files))
+        body = {"model": entry.get("model")} if entry.get("model") else {}
+        body["prompt"] = _filler(max(0, size - len(json.dumps(body)) - 14), seed)
+    else:
+        body = None
+    if body is not None:
+        kwargs["json" if entry.get("body") == "json" else "data"] = body
+    return kwargs
+
+
+def start_stand_in() -> str:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _replay(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            while length > 0:
+                length -= len(self.rfile.read(min(length, _CHUNK))) or length
+            time.sleep(float(self.headers.get("X-Replay-Latency") or 0))
+            status = self.headers.get("X-Replay-Status")
+            if not status:
+                # 原始调用以连接错误或超时结束，替身直接断开连接
+                self.close_connection = True
+                return
+            size = int(self.headers.get("X-Replay-Bytes") or 0)
+            self.send_response(int(status))
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            block = b"0" * _CHUNK
+            while size > 0:
+                self.wfile.write(block[: min(size, _CHUNK)])
+                size -= _CHUNK
+
+        do_GET = _replay
+        do_POST = _replay
+        do_PUT = _replay
+        do_DELETE = _replay
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _percentile(values: List[float], ratio: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * ratio))], 3)
+
+
+def replay(
+    entries: List[dict],
+    target: str,
+    speed: float = 1.0,
+    concurrency: int = 64,
+    timeout: float = 600,
+) -> List[dict]:
+    # speed=2 表示时间线与替身延迟都压缩一半；speed=0 表示不等待记录间隔，按线程池上限尽快发出
+    entries = sorted(entries, key=lambda item: item.get("ts") or 0)
+    if not entries:
+        return []
+    first_ts = entries[0].get("ts") or 0
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    results: List[Optional[dict]] = [None] * len(entries)
+
+    def _one(index: int, entry: dict, due: float) -> None:
+        latency = entry.get("latency") or 0.0
+        headers = {
+            "X-Replay-Latency": str(latency / speed if speed > 0 else latency),
+            "X-Replay-Bytes": str(entry.get("response_bytes") or 0),
+            "X-Replay-Status": str(entry.get("status") or ""),
+        }
+        lag = time.monotonic() - due
+        start = time.monotonic()
+        status, error = None, None
+        try:
+            resp = session.request(
+                entry.get("method") or "GET",
+                f"{target.rstrip('/')}{entry.get('path') or '/'}",
+                headers=headers,
+                timeout=timeout,
+                **build_request(entry, index),
+            )
+            status = resp.status_code
+            resp.close()
+        except requests.RequestException as exc:
+            error = type(exc).__name__
+        results[index] = {
+            "route": entry.get("route") or "default",
+            "recorded_latency": latency,
+            "latency": time.monotonic() - start,
+            "recorded_status": entry.get("status"),
+            "status": status,
+            "error": error,
+            "lag": max(0.0, lag),
+        }
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="replay") as pool:
+        for index, entry in enumerate(entries):
+            offset = ((entry.get("ts") or first_ts) - first_ts) / speed if speed > 0 else 0.0
+            due = started + offset
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(_one, index, entry, due)
+    return [item for item in results if item is not None]
+
+
+def summarize(results: List[dict]) -> Dict[str, dict]:
+    routes: Dict[str, List[dict]] = {}
+    for item in results:
+        routes.setdefault(item["route"], []).append(item)
+    summary = {}
+    for route, items in sorted(routes.items()):
+        summary[route] = {
+            "count": len(items),
+            "recorded_p50": _percentile([item["recorded_latency"] for item in items], 0.5),
+            "recorded_p95": _percentile([item["recorded_latency"] for item in items], 0.95),
+            "replayed_p50": _percentile([item["latency"] for item in items], 0.5),
+            "replayed_p95": _percentile([item["latency"] for item in items], 0.95),
+            "status_mismatch": sum(1 for item in items if item["status"] != item["recorded_status"]),
+            "errors": sum(1 for item in items if item["error"]),
+            "max_lag": round(max(item["lag"] for item in items), 3),
+            "mean_lag": round(statistics.mean(item["lag"] for item in items), 3),
+        }
+    return summary
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="回放上游调用日志")
+    parser.add_argument("journal", nargs="?", default="upstream_journal.jsonl")
+    parser.add_argument("--target", help="回放目标地址，默认启动本地替身")
+    parser.add_argument("--speed", type=float, default=1.0, help="时间线倍速，0 为不等待间隔")
+    parser.add_argument("--routes", help="只回放指定 route，逗号分隔")
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--out", help="把逐条结果与汇总写入 JSON 文件")
+    args = parser.parse_args()
+
+    routes = {item for item in (args.routes or "").split(",") if item}
+    entries = [entry for entry in read_journal(args.journal) if not routes or entry.get("route") in routes]
+    if args.limit:
+        entries = entries[: args.limit]
+    if not entries:
+        print("日志中没有可回放的记录", file=sys.stderr)
+        return 1
+
+    target = args.target or start_stand_in()
+    start = time.monotonic()
+    results = replay(entries, target, speed=args.speed, concurrency=args.concurrency)
+    wall = time.monotonic() - start
+    summary = summarize(results)
+    span = (max(entry.get("ts") or 0 for entry in entries) - min(entry.get("ts") or 0 for entry in entries))
+    print(f"回放 {len(results)} 条记录 -> {target}，原始时长 {span:.1f}s，回放耗时 {wall:.1f}s")
+    for route, item in summary.items():
+        print(
+            f"  {route:<14} n={item['count']:<5} "
+            f"p50 {item['recorded_p50']} -> {item['replayed_p50']}  "
+            f"p95 {item['recorded_p95']} -> {item['replayed_p95']}  "
+            f"状态不一致 {item['status_mismatch']}  错误 {item['errors']}  最大滞后 {item['max_lag']}s"
+        )
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump({"target": target, "speed": args.speed, "summary": summary, "results": results}, fh, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+# request_journal.py
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Iterator, List, Optional
+from urllib.parse import urlsplit
+
+# 默认不记录；设为文件路径（如 upstream_journal.jsonl）后开启，文件不自动轮转，采集完毕后请及时关闭
+UPSTREAM_JOURNAL = os.getenv("UPSTREAM_JOURNAL", "")
+UPSTREAM_JOURNAL_CAPTURE = os.getenv("UPSTREAM_JOURNAL_CAPTURE", "0") == "1"
+UPSTREAM_JOURNAL_BUFFER = int(os.getenv("UPSTREAM_JOURNAL_BUFFER", "64"))
+UPSTREAM_JOURNAL_FLUSH_SECONDS = float(os.getenv("UPSTREAM_JOURNAL_FLUSH_SECONDS", "2"))
+# 记录请求体时超过该长度的字符串（base64 图片等）只保留长度，回放时按长度补齐
+UPSTREAM_JOURNAL_MAX_FIELD = int(os.getenv("UPSTREAM_JOURNAL_MAX_FIELD", "2048"))
+
+OMITTED_PREFIX = "<omitted:"
+_MODEL_IN_PATH = re.compile(r"/models/([^/:]+)")
+
+
+def _redact(value):
+    if isinstance(value, str) and len(value) > UPSTREAM_JOURNAL_MAX_FIELD:
+        return f"{OMITTED_PREFIX}{len(value)}>"
+    if isinstance(value, dict):
+        return {key: _redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_redact(item) for item in value]
+    return value
+
+
+def _prompt_text(body) -> Optional[str]:
+    if not isinstance(body, dict):
+        return None
+    if isinstance(body.get("prompt"), str):
+        return body["prompt"]
+    texts = [
+        part["text"]
+        for content in body.get("contents") or []
+        for part in (content.get("parts") or [])
+        if isinstance(part, dict) and isinstance(part.get("text"), str)
+    ]
+    return "\n".join(texts) if texts else None
+
+
+def _file_sizes(files) -> List[int]:
+    sizes = []
+    for item in files or []:
+        # requests 的 files 可以是 [(field, (name, bytes, mime))] 或 {field: (name, bytes, mime)}
+        spec = item[1] if isinstance(item, tuple) else files[item]
+        content = spec[1] if isinstance(spec, tuple) else spec
+        sizes.append(len(content) if isinstance(content, (bytes, str)) else 0)
+    return sizes
+
+
+def body_size(body) -> Optional[int]:
+    # requests 预处理后的请求体：json / 表单 / multipart 为 bytes 或 str，流式上传无法直接取长度
+    if body is None:
+        return 0
+    if isinstance(body, bytes):
+        return len(body)
+    if isinstance(body, str):
+        return len(body.encode("utf-8"))
+    return None
+
+
+def describe_request(path: str, kwargs: dict, capture: bool = False, request_bytes: Optional[int] = None) -> dict:
+    body = kwargs.get("json")
+    if body is None:
+        body = kwargs.get("data")
+    if isinstance(body, (bytes, str)):
+        body_bytes = len(body)
+        body = None
+    else:
+        # 字典请求体不再为统计大小重新序列化，未拿到预处理后的请求体时记为未知
+        body_bytes = 0 if body is None else None
+    model = body.get("model") if isinstance(body, dict) else None
+    if not model:
+        match = _MODEL_IN_PATH.search(path)
+        model = match.group(1) if match else None
+    prompt = _prompt_text(body)
+    files = _file_sizes(kwargs.get("files"))
+    entry = {
+        "model": model,
+        "prompt_sha256": hashlib.sha256(prompt.encode("utf-8")).hexdigest() if prompt is not None else None,
+        "body": "json" if "json" in kwargs else ("form" if body is not None or files else None),
+        "request_bytes": request_bytes if request_bytes is not None else (
+            body_bytes + sum(files) if body_bytes is not None else None
+        ),
+        "files": files,
+    }
+    if capture and body is not None:
+        # 只记录请求体，不记录请求头，避免 key 落盘
+        entry["payload"] = _redact(body)
+    return entry
+
+
+class RequestJournal:
+    # 追加写入的 JSONL 日志，先写内存缓冲，攒够条数或到达间隔后一次写盘
+    def __init__(
+        self,
+        path: str,
+        capture: bool = UPSTREAM_JOURNAL_CAPTURE,
+        buffer_size: int = UPSTREAM_JOURNAL_BUFFER,
+        flush_seconds: float = UPSTREAM_JOURNAL_FLUSH_SECONDS,
+    ):
+        self.path = path
+        self.capture = capture
+        self.buffer_size = max(1, buffer_size)
+        self.flush_seconds = flush_seconds
+        self.written = 0
+        self.dropped = 0
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="journal-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def record(
+        self,
+        method: str,
+        url: str,
+        route: str,
+        kwargs: Optional[dict] = None,
+        status: Optional[int] = None,
+        latency: float = 0.0,
+        response_bytes: Optional[int] = None,
+        error: Optional[str] = None,
+        request_bytes: Optional[int] = None,
+    ) -> None:
+        try:
+            parts = urlsplit(url)
+            # 签名下载地址的 query 含有凭证，只记录 path
+            base = f"{parts.scheme}://{parts.netloc}" if parts.netloc else None
+            path = parts.path if parts.netloc else url
+            entry = {
+                "ts": round(time.time(), 6),
+                "pid": os.getpid(),
+                "method": method,
+                "route": route,
+                "base": base,
+                "path": path,
+                **describe_request(path, kwargs or {}, self.capture, request_bytes),
+                "status": status,
+                "latency": round(latency, 4),
+                "response_bytes": response_bytes,
+                "error": error,
+            }
+            line = json.dumps(entry, ensure_ascii=False)
+        except Exception:
+            # 日志失败不影响业务请求
+            self.dropped += 1
+            return
+        with self._lock:
+            self._buffer.append(line)
+            full = len(self._buffer) >= self.buffer_size
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._write_lock:
+            with self._lock:
+                lines, self._buffer = self._buffer, []
+            if not lines:
+                return
+            try:
+                # O_APPEND 下单次 write 整批追加，多个进程写同一文件时行不会交错
+                with open(self.path, "a", encoding="utf-8") as fh:
+                    fh.write("\n".join(lines) + "\n")
+                self.written += len(lines)
+            except OSError:
+                self.dropped += len(lines)
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_seconds):
+            self.flush()
+
+    def close(self) -> None:
+        self._stop.set()
+        self.flush()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            pending = len(self._buffer)
+        return {
+            "path": self.path,
+            "capture": self.capture,
+            "written": self.written,
+            "pending": pending,
+            "dropped": self.dropped,
+        }
+
+
+def build_journal(path: Optional[str] = None) -> Optional[RequestJournal]:
+    path = UPSTREAM_JOURNAL if path is None else path
+    if not path or path.lower() == "off":
+        return None
+    return RequestJournal(path)
+
+
+def read_journal(path: str) -> Iterator[dict]:
+    with open(path, "r", encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # 进程被强杀时最后一行可能只写了一半
+                continue
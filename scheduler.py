@@ -0,0 +1,174 @@
+# scheduler.py
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from deadline import Deadline
+
+
+def _parse_weights(value: str) -> Dict[str, int]:
+    weights = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip():
+            weights[name.strip()] = max(1, int(weight or 1))
+    return weights
+
+
+LANE_WEIGHTS = _parse_weights(os.getenv("LANE_WEIGHTS", "interactive=4,batch=1"))
+BATCH_MAX_SHARE = float(os.getenv("BATCH_MAX_SHARE", "0.75"))
+
+
+class SchedulerFull(Exception):
+    def __init__(self, retry_after: int, message: str = "服务繁忙，请稍后重试"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionScheduler:
+    def __init__(
+        self,
+        max_inflight: int,
+        max_queue: int,
+        lane_weights: Optional[Dict[str, int]] = None,
+        lane_limits: Optional[Dict[str, int]] = None,
+        lane_queue_limits: Optional[Dict[str, int]] = None,
+    ):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.lane_weights = dict(lane_weights or LANE_WEIGHTS)
+        self.lane_limits = dict(lane_limits or {})
+        # 每条通道单独限制排队长度，批量任务排满时不会挤掉交互请求的排队位置
+        self.lane_queue_limits = {
+            lane: (lane_queue_limits or {}).get(lane, max_queue) for lane in self.lane_weights
+        }
+        # 每条通道内按租户轮转，避免单个租户的批量任务占满通道
+        self._queues: Dict[str, "OrderedDict[str, Deque[asyncio.Future]]"] = {
+            lane: OrderedDict() for lane in self.lane_weights
+        }
+        self._credits = {lane: 0 for lane in self.lane_weights}
+        self._inflight = {lane: 0 for lane in self.lane_weights}
+        self._queued = 0
+        self._lane_queued = {lane: 0 for lane in self.lane_weights}
+        self._service_time = 10.0
+
+    @property
+    def inflight(self) -> int:
+        return sum(self._inflight.values())
+
+    def snapshot(self) -> dict:
+        return {
+            "inflight": dict(self._inflight),
+            "queued": {
+                lane: sum(len(waiters) for waiters in tenants.values())
+                for lane, tenants in self._queues.items()
+            },
+            "max_inflight": self.max_inflight,
+            "max_queue": dict(self.lane_queue_limits),
+            "service_time": round(self._service_time, 3),
+        }
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self._service_time * (self._queued + 1) / self.max_inflight))
+
+    def _lane_has_room(self, lane: str) -> bool:
+        limit = self.lane_limits.get(lane)
+        return limit is None or self._inflight[lane] < limit
+
+    def _can_start(self, lane: str) -> bool:
+        return self.inflight < self.max_inflight and self._lane_has_room(lane)
+
+    def _pick_lane(self) -> Optional[str]:
+        # 平滑加权轮询：权重高的通道更常被选中，但低权重通道不会饿死
+        ready = [lane for lane, tenants in self._queues.items() if tenants and self._lane_has_room(lane)]
+        if not ready:
+            return None
+        total = sum(self.lane_weights[lane] for lane in ready)
+        for lane in ready:
+            self._credits[lane] += self.lane_weights[lane]
+        lane = max(ready, key=lambda name: self._credits[name])
+        self._credits[lane] -= total
+        return lane
+
+    def _dispatch(self) -> None:
+        while self._queued and self.inflight < self.max_inflight:
+            lane = self._pick_lane()
+            if lane is None:
+                return
+            tenants = self._queues[lane]
+            tenant, waiters = next(iter(tenants.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                tenants.move_to_end(tenant)
+            else:
+                del tenants[tenant]
+            self._queued -= 1
+            self._lane_queued[lane] -= 1
+            self._inflight[lane] += 1
+            waiter.set_result(True)
+
+    def _remove_waiter(self, lane: str, tenant: str, waiter: asyncio.Future) -> None:
+        waiters = self._queues[lane].get(tenant)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            self._queued -= 1
+            self._lane_queued[lane] -= 1
+            if not waiters:
+                del self._queues[lane][tenant]
+
+    async def _acquire(self, lane: str, tenant: str, deadline: Deadline) -> None:
+        if not self._queued and self._can_start(lane):
+            self._inflight[lane] += 1
+            return
+        if self._lane_queued[lane] >= self.lane_queue_limits[lane]:
+            raise SchedulerFull(self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues[lane].setdefault(tenant, deque()).append(waiter)
+        self._queued += 1
+        self._lane_queued[lane] += 1
+        # 队首可能是受通道上限阻塞的批量任务，新来的请求如有空位应立即放行
+        self._dispatch()
+        try:
+            while True:
+                try:
+                    timeout = min(1.0, max(deadline.remaining(), 0.01))
+                    await asyncio.wait_for(asyncio.shield(waiter), timeout=timeout)
+                    return
+                except asyncio.TimeoutError:
+                    deadline.check()
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self._release(lane, None)
+            else:
+                waiter.cancel()
+                self._remove_waiter(lane, tenant, waiter)
+            raise
+
+    def _release(self, lane: str, elapsed: Optional[float]) -> None:
+        self._inflight[lane] -= 1
+        if elapsed is not None:
+            self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, lane: str, tenant: str, deadline: Deadline):
+        if lane not in self.lane_weights:
+            lane = next(iter(self.lane_weights))
+        await self._acquire(lane, tenant, deadline)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(lane, time.monotonic() - start)
+
+
+def build_scheduler(max_inflight: int, max_queue: int) -> AdmissionScheduler:
+    limits = {}
+    if "batch" in LANE_WEIGHTS:
+        limits["batch"] = max(1, int(max_inflight * BATCH_MAX_SHARE))
+    return AdmissionScheduler(max_inflight, max_queue, LANE_WEIGHTS, limits)
@@ -0,0 +1,374 @@
+# shared_state.py
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Optional, Tuple
+
+from deadline import Deadline
+
+# memory：单进程内共享（默认）；sqlite:///path/state.db：同一台机器上的多个 worker 共享
+SHARED_STATE = os.getenv("SHARED_STATE", "memory")
+# 可淘汰条目（各类缓存）的总大小上限，超出后按最近访问时间淘汰
+SHARED_STATE_CACHE_MB = int(os.getenv("SHARED_STATE_CACHE_MB", "256"))
+SHARED_STATE_LOCK_TTL = float(os.getenv("SHARED_STATE_LOCK_TTL", "900"))
+
+_BUCKET_IDLE_TTL = 3600
+
+
+def _size(value: Any) -> int:
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return len(json.dumps(value, ensure_ascii=False))
+
+
+def _bucket(record: Optional[dict], rate: float, burst: float, now: float) -> Tuple[float, float]:
+    if not record:
+        return burst, now
+    tokens = min(burst, record["tokens"] + max(0.0, now - record["updated"]) * rate)
+    return tokens, now
+
+
+class SharedState(ABC):
+    # 跨 worker 共享的键值状态。实现方只需提供以下原子操作，Redis 之类的服务可用
+    # GET/SET EX/SET NX/DEL（比较后删除用 Lua）与 Lua 令牌桶脚本实现同一接口
+    @abstractmethod
+    def get(self, key: str) -> Any:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, evictable: bool = False) -> None:
+        ...
+
+    @abstractmethod
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        # 仅在 key 不存在（或已过期）时写入，返回是否写入成功
+        ...
+
+    @abstractmethod
+    def delete(self, key: str, expected: Any = None) -> bool:
+        # expected 不为 None 时仅在当前值等于 expected 时删除
+        ...
+
+    @abstractmethod
+    def update(self, key: str, fields: dict, ttl: Optional[float] = None) -> dict:
+        # 原子地合并字段，返回合并后的记录
+        ...
+
+    @abstractmethod
+    def take_token(self, key: str, rate: float, burst: float) -> float:
+        # 令牌桶：取到令牌返回 0，否则返回还需等待的秒数
+        ...
+
+    @abstractmethod
+    def tokens(self, key: str, rate: float, burst: float) -> float:
+        ...
+
+    @abstractmethod
+    def drain_tokens(self, key: str) -> None:
+        ...
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__}
+
+    @contextmanager
+    def lock(self, key: str, ttl: float = SHARED_STATE_LOCK_TTL, deadline: Optional[Deadline] = None):
+        # 带过期时间的互斥锁，持有者崩溃后锁会自动释放
+        deadline = deadline or Deadline(ttl)
+        token = uuid.uuid4().hex
+        name = f"lock:{key}"
+        wait = 0.02
+        while not self.add(name, token, ttl):
+            deadline.sleep(wait)
+            wait = min(wait * 2, 0.5)
+        try:
+            yield
+        finally:
+            self.delete(name, expected=token)
+
+    def locked(self, key: str) -> bool:
+        return self.get(f"lock:{key}") is not None
+
+
+class MemoryState(SharedState):
+    def __init__(self, cache_bytes: int = SHARED_STATE_CACHE_MB * 1024 * 1024):
+        self.cache_bytes = cache_bytes
+        self._data: "OrderedDict[str, Tuple[Any, Optional[float], int]]" = OrderedDict()
+        self._evictable_bytes = 0
+        self._lock = threading.Lock()
+
+    def _get(self, key: str, now: float):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= now:
+            self._pop(key)
+            return None
+        self._data.move_to_end(key)
+        return item
+
+    def _pop(self, key: str) -> None:
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._evictable_bytes -= item[2]
+
+    def _put(self, key: str, value: Any, ttl: Optional[float], evictable: bool, now: float) -> None:
+        self._pop(key)
+        size = _size(value) if evictable else 0
+        self._data[key] = (value, now + ttl if ttl else None, size)
+        self._evictable_bytes += size
+        if self._evictable_bytes > self.cache_bytes:
+            for name in [name for name, item in self._data.items() if item[2]]:
+                if self._evictable_bytes <= self.cache_bytes:
+                    break
+                self._pop(name)
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            item = self._get(key, time.time())
+            return None if item is None else item[0]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, evictable: bool = False) -> None:
+        with self._lock:
+            self._put(key, value, ttl, evictable, time.time())
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        now = time.time()
+        with self._lock:
+            if self._get(key, now) is not None:
+                return False
+            self._put(key, value, ttl, False, now)
+            return True
+
+    def delete(self, key: str, expected: Any = None) -> bool:
+        with self._lock:
+            item = self._get(key, time.time())
+            if item is None or (expected is not None and item[0] != expected):
+                return False
+            self._pop(key)
+            return True
+
+    def update(self, key: str, fields: dict, ttl: Optional[float] = None) -> dict:
+        now = time.time()
+        with self._lock:
+            item = self._get(key, now)
+            record = dict(item[0]) if item is not None else {}
+            record.update(fields)
+            self._put(key, record, ttl, False, now)
+            return record
+
+    def take_token(self, key: str, rate: float, burst: float) -> float:
+        now = time.time()
+        with self._lock:
+            item = self._get(key, now)
+            tokens, updated = _bucket(item[0] if item else None, rate, burst, now)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate if rate > 0 else 60.0
+            self._put(key, {"tokens": tokens, "updated": updated}, _BUCKET_IDLE_TTL, False, now)
+            return wait
+
+    def tokens(self, key: str, rate: float, burst: float) -> float:
+        now = time.time()
+        with self._lock:
+            item = self._get(key, now)
+            return _bucket(item[0] if item else None, rate, burst, now)[0]
+
+    def drain_tokens(self, key: str) -> None:
+        with self._lock:
+            self._put(key, {"tokens": 0.0, "updated": time.time()}, _BUCKET_IDLE_TTL, False, time.time())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "keys": len(self._data),
+                "cache_mb": round(self._evictable_bytes / (1024 * 1024), 1),
+                "cache_limit_mb": round(self.cache_bytes / (1024 * 1024), 1),
+            }
+
+
+class SQLiteState(SharedState):
+    # WAL 模式下读写互不阻塞，写操作用 BEGIN IMMEDIATE 串行化，保证多进程下的原子性
+    def __init__(self, path: str, cache_bytes: int = SHARED_STATE_CACHE_MB * 1024 * 1024):
+        self.path = path
+        self.cache_bytes = cache_bytes
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._tx() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                " key TEXT PRIMARY KEY, kind TEXT NOT NULL, value BLOB,"
+                " expires REAL, size INTEGER NOT NULL DEFAULT 0, touched REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS kv_evict ON kv (touched) WHERE size > 0")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # 连接不能跨进程复用，fork 出的 worker 重新建立连接
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _tx(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _encode(value: Any) -> Tuple[str, Any]:
+        if isinstance(value, (bytes, bytearray)):
+            return "b", sqlite3.Binary(bytes(value))
+        return "j", json.dumps(value, ensure_ascii=False)
+
+    @staticmethod
+    def _decode(kind: str, value: Any) -> Any:
+        return bytes(value) if kind == "b" else json.loads(value)
+
+    def _read(self, conn: sqlite3.Connection, key: str, now: float):
+        row = conn.execute("SELECT kind, value, expires FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[2] is not None and row[2] <= now):
+            return None
+        return self._decode(row[0], row[1])
+
+    def _write(self, conn, key: str, value: Any, ttl: Optional[float], evictable: bool, now: float) -> None:
+        kind, encoded = self._encode(value)
+        conn.execute(
+            "INSERT OR REPLACE INTO kv (key, kind, value, expires, size, touched) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, kind, encoded, now + ttl if ttl else None, _size(value) if evictable else 0, now),
+        )
+        self._writes += 1
+
+    def _prune(self) -> None:
+        # 每 256 次写入清理一次过期条目，并把可淘汰条目压回上限以内
+        if self._writes < 256:
+            return
+        self._writes = 0
+        with self._tx() as conn:
+            conn.execute("DELETE FROM kv WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM kv WHERE size > 0").fetchone()[0]
+            if total <= self.cache_bytes:
+                return
+            excess = total - self.cache_bytes
+            for key, size in conn.execute("SELECT key, size FROM kv WHERE size > 0 ORDER BY touched").fetchall():
+                if excess <= 0:
+                    break
+                conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+                excess -= size
+
+    def get(self, key: str) -> Any:
+        conn = self._conn()
+        now = time.time()
+        value = self._read(conn, key, now)
+        if value is not None:
+            # 只刷新可淘汰条目的访问时间，读多写少的缓存命中不必每次都加写锁
+            row = conn.execute("SELECT size, touched FROM kv WHERE key = ?", (key,)).fetchone()
+            if row and row[0] and now - row[1] > 60:
+                conn.execute("UPDATE kv SET touched = ? WHERE key = ?", (now, key))
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, evictable: bool = False) -> None:
+        with self._tx() as conn:
+            self._write(conn, key, value, ttl, evictable, time.time())
+        self._prune()
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        now = time.time()
+        with self._tx() as conn:
+            if self._read(conn, key, now) is not None:
+                return False
+            self._write(conn, key, value, ttl, False, now)
+            return True
+
+    def delete(self, key: str, expected: Any = None) -> bool:
+        with self._tx() as conn:
+            current = self._read(conn, key, time.time())
+            if current is None or (expected is not None and current != expected):
+                return False
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+            return True
+
+    def update(self, key: str, fields: dict, ttl: Optional[float] = None) -> dict:
+        now = time.time()
+        with self._tx() as conn:
+            record = dict(self._read(conn, key, now) or {})
+            record.update(fields)
+            self._write(conn, key, record, ttl, False, now)
+        self._prune()
+        return record
+
+    def take_token(self, key: str, rate: float, burst: float) -> float:
+        now = time.time()
+        with self._tx() as conn:
+            tokens, updated = _bucket(self._read(conn, key, now), rate, burst, now)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate if rate > 0 else 60.0
+            self._write(conn, key, {"tokens": tokens, "updated": updated}, _BUCKET_IDLE_TTL, False, now)
+        self._prune()
+        return wait
+
+    def tokens(self, key: str, rate: float, burst: float) -> float:
+        now = time.time()
+        return _bucket(self._read(self._conn(), key, now), rate, burst, now)[0]
+
+    def drain_tokens(self, key: str) -> None:
+        now = time.time()
+        with self._tx() as conn:
+            self._write(conn, key, {"tokens": 0.0, "updated": now}, _BUCKET_IDLE_TTL, False, now)
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        keys, cache = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM kv").fetchone()
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "keys": keys,
+            "cache_mb": round(cache / (1024 * 1024), 1),
+            "cache_limit_mb": round(self.cache_bytes / (1024 * 1024), 1),
+        }
+
+
+def build_state(url: Optional[str] = None) -> SharedState:
+    url = (url or SHARED_STATE).strip()
+    if url == "memory":
+        return MemoryState()
+    if url.startswith("sqlite://"):
+        path = url[len("sqlite://"):]
+        if not path:
+            raise ValueError("SHARED_STATE 缺少 SQLite 文件路径，例如 sqlite:///var/lib/app/state.db")
+        return SQLiteState(path)
+    raise ValueError(f"不支持的 SHARED_STATE：{url}（可选 memory / sqlite:///path）")
+
+
+_state: Optional[SharedState] = None
+_state_lock = threading.Lock()
+
+
+def get_state() -> SharedState:
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = build_state()
+        return _state
@@ -1,57 +1,165 @@
 # templates.py
 
-VIDEO_TEMPLATES = {
-    "Amazon Hero 6s": {
-        "platform": "Amazon",
-        "duration": 6,
-        "motion": "slow push in",
-        "lighting": "studio soft light",
-        "style": "clean premium",
-        "ratio": "1:1"
-    },
+import json
+import os
+import threading
+import time
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
-    "Taobao Fast Hook 3s": {
-        "platform": "Taobao",
-        "duration": 3,
-        "motion": "fast dynamic move",
-        "lighting": "bright commercial",
-        "style": "high contrast",
-        "ratio": "1:1"
-    },
+TEMPLATES_PATH = os.getenv(
+    "TEMPLATES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates.json"),
+)
+TEMPLATES_RELOAD_INTERVAL = float(os.getenv("TEMPLATES_RELOAD_INTERVAL", "2"))
+
+_REQUIRED_FIELDS = ("platform", "duration", "motion", "lighting", "style", "ratio")
+_INDEXED_FIELDS = ("platform", "ratio", "duration")
+
+
+class TemplateRegistry(Mapping):
+    # 模板从 JSON 文件加载并按平台 / 画幅 / 时长建索引；文件修改后自动重新加载，无需重启
+    def __init__(self, path: str = TEMPLATES_PATH, reload_interval: float = TEMPLATES_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.last_error = ""
+        self._templates: Dict[str, dict] = {}
+        self._indexes: Dict[str, Dict[object, Set[str]]] = {}
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.reload(force=True)
+
+    def _load(self) -> Tuple[Dict[str, dict], Dict[str, Dict[object, Set[str]]]]:
+        with open(self.path, "r", encoding="utf-8") as fh:
+            data = json.load(fh)
+        if not isinstance(data, dict):
+            raise ValueError("模板文件应为 {模板名: 配置} 格式")
+        indexes: Dict[str, Dict[object, Set[str]]] = {field: {} for field in _INDEXED_FIELDS}
+        for name, config in data.items():
+            if not isinstance(config, dict):
+                raise ValueError(f"模板 {name} 的配置应为对象")
+            missing = [field for field in _REQUIRED_FIELDS if field not in config]
+            if missing:
+                raise ValueError(f"模板 {name} 缺少字段：{', '.join(missing)}")
+            for field, index in indexes.items():
+                # 索引字段必须是标量，列表 / 对象无法作为索引键
+                if not isinstance(config[field], (str, int, float, bool)):
+                    raise ValueError(f"模板 {name} 的 {field} 应为字符串或数字")
+                index.setdefault(config[field], set()).add(name)
+        return data, indexes
+
+    def reload(self, force: bool = False) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as exc:
+            self.last_error = str(exc)
+            return False
+        if not force and mtime == self._mtime:
+            return False
+        try:
+            templates, indexes = self._load()
+        except Exception as exc:
+            # 新文件有误时保留上一版模板，避免线上模板全部失效
+            self.last_error = f"模板加载失败：{exc}"
+            self._mtime = mtime
+            if force and not self._templates:
+                raise
+            return False
+        with self._lock:
+            self._templates = templates
+            self._indexes = indexes
+            self._mtime = mtime
+        self.last_error = ""
+        return True
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval:
+            return
+        self._checked = now
+        self.reload()
+
+    def __getitem__(self, name: str) -> dict:
+        self._maybe_reload()
+        return self._templates[name]
 
-    "Luxury Studio 8s": {
+    def __iter__(self) -> Iterator[str]:
+        self._maybe_reload()
+        return iter(list(self._templates))
+
+    def __len__(self) -> int:
+        self._maybe_reload()
+        return len(self._templates)
+
+    def find(
+        self,
+        platform: Optional[str] = None,
+        ratio: Optional[str] = None,
+        duration: Optional[int] = None,
+    ) -> List[str]:
+        self._maybe_reload()
+        with self._lock:
+            names: Optional[Set[str]] = None
+            for field, value in (("platform", platform), ("ratio", ratio), ("duration", duration)):
+                if value is None:
+                    continue
+                matched = self._indexes[field].get(value, set())
+                names = set(matched) if names is None else names & matched
+            if names is None:
+                return list(self._templates)
+            return [name for name in self._templates if name in names]
+
+
+VIDEO_TEMPLATES = TemplateRegistry()
+
+
+IMAGE_DERIVATIVES = {
+    "Amazon Main 2000": {
         "platform": "Amazon",
-        "duration": 8,
-        "motion": "cinematic rotate",
-        "lighting": "dramatic shadow",
-        "style": "luxury high-end",
-        "ratio": "16:9"
+        "size": (2000, 2000),
+        "fit": "pad",
+        "format": "JPEG",
+        "quality": 90
     },
 
-    "Japanese Minimal 6s": {
+    "Amazon JP Main 1600": {
         "platform": "Amazon JP",
-        "duration": 6,
-        "motion": "gentle push",
-        "lighting": "natural soft",
-        "style": "minimal japanese",
-        "ratio": "1:1"
+        "size": (1600, 1600),
+        "fit": "pad",
+        "format": "JPEG",
+        "quality": 90
     },
 
-    "Functional Showcase 12s": {
+    "Taobao Main 800": {
         "platform": "Taobao",
-        "duration": 12,
-        "motion": "multi-angle",
-        "lighting": "neutral",
-        "style": "product focus",
-        "ratio": "16:9"
+        "size": (800, 800),
+        "fit": "crop",
+        "format": "JPEG",
+        "quality": 85
+    },
+
+    "Taobao Detail 750": {
+        "platform": "Taobao",
+        "size": (750, None),
+        "fit": "width",
+        "format": "JPEG",
+        "quality": 85
+    },
+
+    "TikTok Shop 1:1 WebP": {
+        "platform": "TikTok Shop",
+        "size": (1200, 1200),
+        "fit": "crop",
+        "format": "WEBP",
+        "quality": 85
     },
 
-    "360 Product Spin": {
+    "Story 9:16 WebP": {
         "platform": "Universal",
-        "duration": 6,
-        "motion": "360 rotation",
-        "lighting": "studio",
-        "style": "clear",
-        "ratio": "1:1"
+        "size": (1080, 1920),
+        "fit": "crop",
+        "format": "WEBP",
+        "quality": 85
     }
 }
@@ -0,0 +1,57 @@
+# test_scheduler.py
+import asyncio
+
+import pytest
+
+from deadline import Deadline
+from scheduler import AdmissionScheduler, SchedulerFull
+
+
+def test_batch_flood_does_not_reject_interactive():
+    async def scenario():
+        scheduler = AdmissionScheduler(2, 3, {"interactive": 4, "batch": 1}, {"batch": 1})
+        release = asyncio.Event()
+        admitted = []
+
+        async def hold(lane: str, tenant: str):
+            async with scheduler.slot(lane, tenant, Deadline(30)):
+                admitted.append(lane)
+                await release.wait()
+
+        tasks = [asyncio.create_task(hold("batch", f"batch-{index}")) for index in range(4)]
+        await asyncio.sleep(0.05)
+        # 批量通道：1 个在途，3 个排队，队列已满
+        with pytest.raises(SchedulerFull):
+            await scheduler._acquire("batch", "batch-overflow", Deadline(30))
+
+        tasks += [asyncio.create_task(hold("interactive", f"user-{index}")) for index in range(3)]
+        await asyncio.sleep(0.05)
+        snapshot = scheduler.snapshot()
+        assert snapshot["inflight"] == {"interactive": 1, "batch": 1}
+        assert snapshot["queued"] == {"interactive": 2, "batch": 3}
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert admitted.count("interactive") == 3
+        assert admitted.count("batch") == 4
+
+    asyncio.run(scenario())
+
+
+def test_lane_queue_full_rejects_only_that_lane():
+    async def scenario():
+        scheduler = AdmissionScheduler(1, 1, {"interactive": 4, "batch": 1}, {}, {"interactive": 1, "batch": 1})
+        async with scheduler.slot("batch", "a", Deadline(30)):
+            waiter = asyncio.create_task(scheduler._acquire("interactive", "b", Deadline(30)))
+            await asyncio.sleep(0.01)
+            with pytest.raises(SchedulerFull):
+                await scheduler._acquire("interactive", "c", Deadline(30))
+            queued = asyncio.create_task(scheduler._acquire("batch", "d", Deadline(30)))
+            await asyncio.sleep(0.01)
+            assert scheduler.snapshot()["queued"] == {"interactive": 1, "batch": 1}
+        await waiter
+        scheduler._release("interactive", None)
+        await queued
+        scheduler._release("batch", None)
+
+    asyncio.run(scenario())
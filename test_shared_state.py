@@ -0,0 +1,60 @@
+# test_shared_state.py
+import multiprocessing
+
+import pytest
+
+from deadline import Deadline
+from key_pool import KeyPool
+from scheduler import SchedulerFull
+from shared_state import SharedState, SQLiteState
+
+WORKERS = 4
+BURST = 20
+
+
+def _worker(path: str, index: int, start, results) -> None:
+    state = SQLiteState(path)
+    # 令牌几乎不回填，所有 worker 合计只能取到 BURST 次
+    pool = KeyPool(["shared-key"], rate_per_min=0.001, burst=BURST, state=state)
+    start.wait()
+    acquired = 0
+    while True:
+        try:
+            pool.acquire(Deadline(5))
+        except SchedulerFull:
+            break
+        acquired += 1
+    won = sum(1 for slot in range(10) if state.add(f"once:{slot}", index))
+    for round_ in range(10):
+        state.update("merged", {f"worker{index}:{round_}": True})
+    results.put((acquired, won))
+
+
+def test_sqlite_state_is_atomic_across_processes(tmp_path):
+    path = str(tmp_path / "state.db")
+    SQLiteState(path)
+    ctx = multiprocessing.get_context("spawn")
+    start = ctx.Event()
+    results = ctx.Queue()
+    processes = [ctx.Process(target=_worker, args=(path, index, start, results)) for index in range(WORKERS)]
+    for process in processes:
+        process.start()
+    start.set()
+    outcomes = [results.get(timeout=60) for _ in processes]
+    for process in processes:
+        process.join(timeout=30)
+        assert process.exitcode == 0
+
+    assert sum(acquired for acquired, _ in outcomes) == BURST
+    assert sum(won for _, won in outcomes) == 10
+    merged = SQLiteState(path).get("merged")
+    assert len(merged) == WORKERS * 10
+
+
+def test_incomplete_backend_fails_at_construction():
+    class GetOnly(SharedState):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnly()
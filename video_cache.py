@@ -0,0 +1,225 @@
+# video_cache.py
+import hashlib
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+from deadline import Deadline
+from shared_state import get_state
+from video_reframe import RATIO_MAX_SIZE, VIDEO_CACHE_DIR, _remove_quietly, reframing_ids, source_path
+
+VIDEO_CACHE_MB = int(os.getenv("VIDEO_CACHE_MB", "4096"))
+# 最近被访问过的视频不参与淘汰，避免删掉正在下发的文件
+VIDEO_CACHE_MIN_AGE = float(os.getenv("VIDEO_CACHE_MIN_AGE", "300"))
+VIDEO_CACHE_MAX_AGE = int(os.getenv("VIDEO_CACHE_MAX_AGE", "86400"))
+
+_ETAG_SUFFIX = ".sha256"
+
+_evict_lock = threading.Lock()
+_etags: Dict[Tuple[str, float, int], str] = {}
+
+
+def fetch_lock(video_id: str, deadline: Optional[Deadline] = None):
+    # 同一视频并发未命中时只回源一次（跨 worker 生效），其余请求等待后直接读缓存
+    return get_state().lock(f"video:fetch:{video_id}", deadline=deadline)
+
+
+def touch(video_id: str) -> None:
+    # 目录的 mtime 作为最近访问时间，文件本身的 mtime 不变，Last-Modified 保持稳定
+    try:
+        os.utime(os.path.dirname(source_path(video_id)), None)
+    except OSError:
+        pass
+
+
+def cache_source(video_id: str, chunks: Iterable[bytes]) -> str:
+    # 边下载边写盘并计算哈希，视频不在内存中整体驻留
+    path = source_path(video_id)
+    if os.path.exists(path):
+        touch(video_id)
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    digest = hashlib.sha256()
+    try:
+        with open(tmp_path, "wb") as fh:
+            for chunk in chunks:
+                digest.update(chunk)
+                fh.write(chunk)
+        with open(f"{path}{_ETAG_SUFFIX}", "w", encoding="ascii") as fh:
+            fh.write(digest.hexdigest())
+        os.replace(tmp_path, path)
+    except BaseException:
+        _remove_quietly(tmp_path)
+        raise
+    touch(video_id)
+    enforce_limit()
+    return path
+
+
+def file_etag(path: str) -> str:
+    stat_result = os.stat(path)
+    key = (path, stat_result.st_mtime, stat_result.st_size)
+    etag = _etags.get(key)
+    if etag:
+        return etag
+    sidecar = f"{path}{_ETAG_SUFFIX}"
+    digest = ""
+    if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= stat_result.st_mtime - 1:
+        with open(sidecar, "r", encoding="ascii") as fh:
+            digest = fh.read().strip()
+    if not digest:
+        # 转码产物等没有随写入计算哈希的文件，首次访问时补算并落盘
+        hasher = hashlib.sha256()
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()
+        try:
+            with open(sidecar, "w", encoding="ascii") as fh:
+                fh.write(digest)
+        except OSError:
+            pass
+    # 内容哈希作为强 ETag，多个副本各自缓存同一视频时 ETag 一致
+    etag = f'"{digest[:32]}"'
+    if len(_etags) > 4096:
+        _etags.clear()
+    _etags[key] = etag
+    return etag
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for entry in os.scandir(path):
+        if entry.is_file(follow_symlinks=False):
+            total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+
+def _busy(video_id: str, reframing: set) -> bool:
+    if video_id in reframing:
+        return True
+    state = get_state()
+    if state.locked(f"video:fetch:{video_id}"):
+        return True
+    # 其他 worker 正在转码的视频同样不能删除
+    return any(state.locked(f"video:reframe:{video_id}:{ratio}") for ratio in RATIO_MAX_SIZE)
+
+
+def enforce_limit(limit_mb: Optional[int] = None) -> int:
+    limit = (VIDEO_CACHE_MB if limit_mb is None else limit_mb) * 1024 * 1024
+    if limit <= 0 or not os.path.isdir(VIDEO_CACHE_DIR):
+        return 0
+    with _evict_lock:
+        entries = []
+        total = 0
+        for entry in os.scandir(VIDEO_CACHE_DIR):
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            size = _dir_size(entry.path)
+            total += size
+            entries.append((entry.stat().st_mtime, entry.name, entry.path, size))
+        if total <= limit:
+            return 0
+        reframing = reframing_ids()
+        now = time.time()
+        removed = 0
+        for accessed, name, path, size in sorted(entries):
+            if total <= limit:
+                break
+            if now - accessed < VIDEO_CACHE_MIN_AGE or _busy(name, reframing):
+                continue
+            # 已打开的文件描述符在删除后仍然有效，正在下发的响应不受影响
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
+
+def cache_stats() -> dict:
+    videos = 0
+    total = 0
+    if os.path.isdir(VIDEO_CACHE_DIR):
+        for entry in os.scandir(VIDEO_CACHE_DIR):
+            if entry.is_dir(follow_symlinks=False):
+                videos += 1
+                total += _dir_size(entry.path)
+    return {"videos": videos, "size_mb": round(total / (1024 * 1024), 1), "limit_mb": VIDEO_CACHE_MB}
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    # If-None-Match 按弱比较处理
+    tags = [item.strip() for item in header.split(",")]
+    return "*" in tags or etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+class VideoFileResponse(FileResponse):
+    # 在 FileResponse 的 Range / pathsend 之上补充 If-None-Match 与 ASGI zerocopy 扩展
+    def __init__(self, path: str, etag: str, max_age: int = VIDEO_CACHE_MAX_AGE, **kwargs):
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers.setdefault("ETag", etag)
+        headers.setdefault("Cache-Control", f"private, max-age={max_age}")
+        super().__init__(path, media_type=kwargs.pop("media_type", "video/mp4"), headers=headers, **kwargs)
+        self.etag = etag
+
+    def _zerocopy_span(self, scope: Scope, size: int) -> Optional[Tuple[int, int, int]]:
+        headers = Headers(scope=scope)
+        http_range = headers.get("range")
+        http_if_range = headers.get("if-range")
+        if http_range is None or (http_if_range is not None and not self._should_use_range(http_if_range)):
+            return 200, 0, size
+        try:
+            ranges = self._parse_range_header(http_range, size)
+        except Exception:
+            # 非法或越界的 Range 交给 FileResponse 生成 400 / 416
+            return None
+        if not ranges:
+            return 200, 0, size
+        if len(ranges) == 1:
+            return 206, ranges[0][0], ranges[0][1]
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await super().__call__(scope, receive, send)
+        if _etag_matches(Headers(scope=scope).get("if-none-match"), self.etag):
+            keep = {b"etag", b"cache-control", b"last-modified"}
+            headers = [(name, value) for name, value in self.raw_headers if name in keep]
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        zerocopy = "http.response.zerocopy" in scope.get("extensions", {})
+        if not zerocopy or scope["method"].upper() == "HEAD":
+            # 服务器不支持 zerocopy 时由 FileResponse 处理：支持 pathsend 则用 pathsend，否则分块读取
+            return await super().__call__(scope, receive, send)
+
+        stat_result = os.stat(self.path)
+        self.set_stat_headers(stat_result)
+        span = self._zerocopy_span(scope, stat_result.st_size)
+        if span is None:
+            return await super().__call__(scope, receive, send)
+        status, start, end = span
+        headers = [(name, value) for name, value in self.raw_headers if name != b"content-length"]
+        headers.append((b"content-length", str(end - start).encode("latin-1")))
+        if status == 206:
+            headers.append((b"content-range", f"bytes {start}-{end - 1}/{stat_result.st_size}".encode("latin-1")))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        with open(self.path, "rb") as fh:
+            # 按 ASGI zerocopy 扩展传入文件对象，由服务器用 sendfile 直接写入 socket，数据不经过 Python 缓冲区
+            await send({
+                "type": "http.response.zerocopy",
+                "file": fh,
+                "offset": start,
+                "count": end - start,
+                "more_body": False,
+            })
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,147 @@
+# video_reframe.py
+import os
+import re
+import shutil
+import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Tuple
+
+from shared_state import get_state
+
+VIDEO_CACHE_DIR = os.getenv(
+    "VIDEO_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".video_cache"),
+)
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+REFRAME_WORKERS = int(os.getenv("REFRAME_WORKERS", "2"))
+REFRAME_TIMEOUT = int(os.getenv("REFRAME_TIMEOUT", "300"))
+
+# 输出长边上限，源视频更小时不放大
+RATIO_MAX_SIZE = {
+    "1:1": (1080, 1080),
+    "9:16": (1080, 1920),
+    "16:9": (1920, 1080),
+    "4:5": (1080, 1350),
+}
+
+_VIDEO_ID_RE = re.compile(r"^[A-Za-z0-9_.\-]{1,128}$")
+
+_pool = ThreadPoolExecutor(max_workers=REFRAME_WORKERS, thread_name_prefix="reframe")
+_inflight: Dict[Tuple[str, str], Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def _video_dir(video_id: str) -> str:
+    if not _VIDEO_ID_RE.match(video_id or "") or video_id.startswith("."):
+        raise ValueError(f"非法的 video_id：{video_id}")
+    return os.path.join(VIDEO_CACHE_DIR, video_id)
+
+
+def _ratio_parts(ratio: str) -> Tuple[int, int]:
+    if ratio not in RATIO_MAX_SIZE:
+        raise ValueError(f"不支持的画幅：{ratio}（可选 {', '.join(RATIO_MAX_SIZE)}）")
+    w, h = ratio.split(":")
+    return int(w), int(h)
+
+
+def source_path(video_id: str) -> str:
+    return os.path.join(_video_dir(video_id), "source.mp4")
+
+
+def reframed_path(video_id: str, ratio: str) -> str:
+    _ratio_parts(ratio)
+    return os.path.join(_video_dir(video_id), f"{ratio.replace(':', 'x')}.mp4")
+
+
+def has_source(video_id: str) -> bool:
+    return os.path.exists(source_path(video_id))
+
+
+def _ffmpeg_filter(ratio: str) -> str:
+    rw, rh = _ratio_parts(ratio)
+    max_w, _ = RATIO_MAX_SIZE[ratio]
+    crop = (
+        f"crop=w='trunc(min(iw,ih*{rw}/{rh})/2)*2'"
+        f":h='trunc(min(ih,iw*{rh}/{rw})/2)*2'"
+    )
+    scale = f"scale=w='min({max_w},iw)':h=-2"
+    return f"{crop},{scale},setsar=1"
+
+
+def _run_reframe(video_id: str, ratio: str) -> str:
+    # 进程内由 _inflight 去重，跨 worker 由共享锁去重，拿到锁后先检查其他 worker 是否已转码完成
+    with get_state().lock(f"video:reframe:{video_id}:{ratio}", ttl=REFRAME_TIMEOUT + 60):
+        return _reframe_locked(video_id, ratio)
+
+
+def _reframe_locked(video_id: str, ratio: str) -> str:
+    src = source_path(video_id)
+    dst = reframed_path(video_id, ratio)
+    if os.path.exists(dst):
+        return dst
+    if not os.path.exists(src):
+        raise ValueError(f"未找到视频 {video_id} 的源文件，请先下载原视频。")
+    binary = shutil.which(FFMPEG_BIN)
+    if not binary:
+        raise ValueError("未找到 ffmpeg，可通过 FFMPEG_BIN 指定可执行文件路径。")
+
+    tmp_path = f"{dst}.{os.getpid()}.tmp.mp4"
+    cmd = [
+        binary, "-y", "-hide_banner", "-loglevel", "error",
+        "-i", src,
+        "-map", "0:v:0", "-map", "0:a?",
+        "-vf", _ffmpeg_filter(ratio),
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "20", "-pix_fmt", "yuv420p",
+        "-c:a", "copy",
+        "-movflags", "+faststart",
+        tmp_path,
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=REFRAME_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        _remove_quietly(tmp_path)
+        raise TimeoutError(f"视频转码超时（{ratio}）")
+    if result.returncode != 0:
+        _remove_quietly(tmp_path)
+        raise ValueError(f"视频转码失败（{ratio}）：{result.stderr.decode('utf-8', errors='ignore')[-500:]}")
+    os.replace(tmp_path, dst)
+    return dst
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def submit_reframe(video_id: str, ratio: str) -> Future:
+    dst = reframed_path(video_id, ratio)
+    key = (video_id, ratio)
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+        if os.path.exists(dst):
+            future = Future()
+            future.set_result(dst)
+            return future
+        future = _pool.submit(_run_reframe, video_id, ratio)
+        _inflight[key] = future
+
+    def _done(_: Future) -> None:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+    future.add_done_callback(_done)
+    return future
+
+
+def reframing_ids() -> set:
+    with _inflight_lock:
+        return {video_id for video_id, _ in _inflight}
+
+
+def reframe_video(video_id: str, ratio: str) -> str:
+    return submit_reframe(video_id, ratio).result()